@@ -0,0 +1,191 @@
+import argparse
+import json
+import numpy as np
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from src.batched_allocation_solver import BatchedAllocationSolver
+from src.bounded_allocation_solver import BoundedAllocationSolver
+from src.configuration import CONFIGS, ProblemConfiguration
+from src.input_generation import InputGenerator
+from src.lp_backend import HIGHS, get_available_solvers
+from src.lp_solver import LPSolverWrapper
+from src.prediction import get_predictions
+from src.rounding import RoundingSolver
+from src.verification import verify_solution
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Synthetic families: 100 items per buyer (as in config 3) with a varying number of buyers per item
+SCALED_ITEMS = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+SCALED_MAX_BUYERS = [3, 10, 40]
+# The default error rates of the experiment, the solvers run with the last one
+PREDICTION_ERRORS = [0.0, 0.01, 0.1]
+# Short runs whose time is dominated by the start of the interpreter and the imports
+STARTUP_COMMANDS = {
+    'help': ['main.py', '--help'],
+    'invalid_arguments': ['main.py', '--jobs', '0'],
+    'validate_arguments': ['-c', 'import main; main.validate_arguments(main.parse_arguments())'],
+    'import_solvers': ['-c', 'import src.batched_allocation_solver, src.bounded_allocation_solver, src.fixed_point_allocation_solver'],
+    'import_lp_solver': ['-c', 'import src.lp_solver'],
+    'import_visualization': ['-c', 'import src.visualization']
+}
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Benchmarks the stages of the experiment over the configurations.')
+    parser.add_argument('-m', '--max_items', type=int, default=10 ** 4, help='The cases with more items are skipped.')
+    parser.add_argument('-l', '--lp_max_items', type=int, default=10 ** 4, help='The LP is built and solved only for the cases with at most this many items.')
+    parser.add_argument('-s', '--lp_solver', type=str, default=HIGHS, help='The LP solver: HIGHS (HiGHS in the process) or a PuLP solver.')
+    parser.add_argument('-n', '--number_of_experiments', type=int, default=4, help='The value of eta will range from 0/n to n/n.')
+    parser.add_argument('--time_limit', type=float, default=10.0, help='Time limit of the local search of the rounding heuristic in seconds.')
+    parser.add_argument('-p', '--peak_memory', action='store_true', help='If set, the peak memory of each stage is measured in an extra traced run.')
+    parser.add_argument('-r', '--repeat', type=int, default=1, help='The wall time is the minimum over this many runs of each stage.')
+    parser.add_argument('-t', '--threshold', type=float, default=0.2, help='Relative increase over the baseline flagged as a regression.')
+    parser.add_argument('-b', '--save_baseline', action='store_true', help='If set, the results are saved as the new baseline.')
+    return parser.parse_args()
+
+
+def validate_arguments(args):
+    if args.max_items < 1 or args.lp_max_items < 0:
+        sys.exit('ERROR: The item limits should be positive!')
+
+    if args.lp_solver not in get_available_solvers():
+        sys.exit(f'ERROR: The LP solver [{args.lp_solver}] is not available!')
+
+    if args.number_of_experiments < 1:
+        sys.exit('ERROR: The number of experiments should be at least 1!')
+
+    if args.time_limit < 0.0:
+        sys.exit('ERROR: The time limit should be at least 0.0!')
+
+    if args.repeat < 1:
+        sys.exit('ERROR: The number of repetitions should be at least 1!')
+
+    if args.threshold < 0.0:
+        sys.exit('ERROR: The threshold should be at least 0.0!')
+
+
+def get_cases(max_items):
+    cases = {f'config_{config_id}': configuration for config_id, configuration in CONFIGS.items()}
+    for num_items in SCALED_ITEMS:
+        for max_buyers in SCALED_MAX_BUYERS:
+            num_buyers = max(num_items // 100, 2 * max_buyers)
+            configuration = ProblemConfiguration(num_buyers, num_items, 10, 1000, 1, max_buyers, 1, 10, num_items + max_buyers)
+            cases[f'scaled_{num_items}_{max_buyers}'] = configuration
+    return {name: configuration for name, configuration in cases.items() if configuration.num_items <= max_items}
+
+
+def measure(function, repeat, peak_memory):
+    # The wall time is measured without tracing, the peak memory (if asked, None otherwise) in an extra traced run
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    if not peak_memory:
+        return result, {'time': min(times), 'peak_memory': None}
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {'time': min(times), 'peak_memory': peak}
+
+
+def measure_process(arguments, repeat):
+    # The wall time of a fresh interpreter running the arguments. The peak memory of the child
+    # process is not comparable (a forked child starts with the memory of this process), so it is 0.
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + arguments, cwd=DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return {'time': min(times), 'peak_memory': 0}
+
+
+def run_startup(repeat):
+    return {name: measure_process(arguments, repeat) for name, arguments in STARTUP_COMMANDS.items()}
+
+
+def run_case(configuration, eta_values, args):
+    stages = {}
+    data, stages['generate'] = measure(lambda: InputGenerator(configuration).generate(), args.repeat, args.peak_memory)
+
+    # The LP is solved only on the smaller cases, the predictions come from the relaxation solved as a maximum flow
+    if configuration.num_items <= args.lp_max_items:
+        lp_solver = LPSolverWrapper(data, None, verbose=0, integral=False, solver_name=args.lp_solver)
+        _, stages['lp_build'] = measure(lp_solver.build_model, args.repeat, args.peak_memory)
+        _, stages['lp_solve'] = measure(lp_solver.solve, args.repeat, args.peak_memory)
+
+    max_flow_solver = LPSolverWrapper(data, None, verbose=0, integral=False, max_flow=True)
+    _, stages['max_flow'] = measure(max_flow_solver.solve, args.repeat, args.peak_memory)
+    solution = max_flow_solver.fractional_solution
+
+    # The integral solution of the rounding heuristic, from the fractions of the CSR entries. Every run has the whole time limit.
+    fractions = np.empty(len(data.item_buyers))
+    fractions[data.buyer_entries] = max_flow_solver.fractional_values
+    _, stages['rounding'] = measure(lambda: RoundingSolver(data, fractions, time.time() + args.time_limit).solve(), args.repeat, args.peak_memory)
+
+    prediction_matrix, stages['get_predictions'] = measure(lambda: get_predictions(data, PREDICTION_ERRORS, solution, configuration.random_seed), args.repeat, args.peak_memory)
+    predictions = prediction_matrix[-1]
+
+    solver = BoundedAllocationSolver(data, verbose=0)
+    _, stages['solve'] = measure(lambda: [solver.solve(eta, predictions) for eta in eta_values], args.repeat, args.peak_memory)
+    _, stages['batched_solve'] = measure(lambda: BatchedAllocationSolver(data).solve(eta_values, predictions), args.repeat, args.peak_memory)
+    _, stages['verify_solution'] = measure(lambda: verify_solution(solver.assignment, data), args.repeat, args.peak_memory)
+    return stages
+
+
+def get_regressions(results, baseline, threshold):
+    # Times under 10 ms are too noisy to compare, the peak memory is compared if both runs measured it
+    regressions = []
+    for name, stages in results.items():
+        for stage, result in stages.items():
+            if name not in baseline or stage not in baseline[name]:
+                continue
+            base = baseline[name][stage]
+            if result['time'] > 0.01 and result['time'] > base['time'] * (1.0 + threshold):
+                regressions.append(f"{name} {stage}: time {result['time']:.4f} s, baseline {base['time']:.4f} s")
+            if result['peak_memory'] is None or base['peak_memory'] is None:
+                continue
+            if result['peak_memory'] > base['peak_memory'] * (1.0 + threshold):
+                regressions.append(f"{name} {stage}: peak memory {result['peak_memory']} B, baseline {base['peak_memory']} B")
+    return regressions
+
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    validate_arguments(args)
+
+    eta_values = [k / args.number_of_experiments for k in range(args.number_of_experiments + 1)]
+    result_file = os.path.abspath(f'{DIR}/benchmarks/result.json')
+    baseline_file = os.path.abspath(f'{DIR}/benchmarks/baseline.json')
+
+    cases = {'startup': None, **get_cases(args.max_items)}
+    results = {}
+    for name, configuration in cases.items():
+        results[name] = run_startup(args.repeat) if configuration is None else run_case(configuration, eta_values, args)
+        for stage, result in results[name].items():
+            peak_memory = '-' if result['peak_memory'] is None else f"{result['peak_memory'] / 2**20:.2f} MB"
+            print(f"{name}\t{stage:<20}\ttime = {result['time']:.4f} s,\tpeak memory = {peak_memory}")
+
+    with open(result_file, 'w+') as out_file:
+        json.dump(results, out_file, indent=4)
+
+    if args.save_baseline:
+        with open(baseline_file, 'w+') as out_file:
+            json.dump(results, out_file, indent=4)
+        print('Baseline saved.')
+    elif os.path.exists(baseline_file):
+        with open(baseline_file, 'r') as in_file:
+            regressions = get_regressions(results, json.load(in_file), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION: {regression}')
+        if regressions:
+            sys.exit('Benchmark regressions found!')
+        print('No regressions found.')
@@ -3,16 +3,13 @@ import os
 import sys
 
 from collections import defaultdict
+from dataclasses import replace
 
-from src.bounded_allocation_solver import BoundedAllocationSolver
 from src.configuration import CONFIGS
-from src.input_generation import InputGenerator
-from src.lp_solver import LPSolverWrapper
-from src.manual_input import MANUAL_INPUTS
-from src.prediction import include_prediction
 from src.utils import ROUND
-from src.verification import verify_solution
-from src.visualization import plot_result, plot_metrics
+
+# The heavy dependencies (NumPy, PuLP and the plotting libraries) are imported by the stages
+# using them, so --help, --clean, invalid arguments and fully cached runs start fast
 
 DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -23,7 +20,19 @@ def parse_arguments():
     parser.add_argument('-n', '--number_of_experiments', type=int, default=10, help='The value of eta will range from 0/n to n/n.')
     parser.add_argument('-i', '--config_id', type=int, default=1, help='The id of the configuration to use.')
     parser.add_argument('-m', '--manual', action='store_true', help='If set, config id points to a manual input.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes running the experiments.')
     parser.add_argument('-v', '--verbose', type=int, default=0, help='Sets the execution\'s verbose level. [0, 1 or 2]')
+    parser.add_argument('-s', '--stepped', action='store_true', help='If set, the buyers reach eta by allocating the item in small steps instead of exactly.')
+    parser.add_argument('--cache_size', type=int, default=1024, help='Size limit of the cache (LP solutions and generated instances) in megabytes.')
+    parser.add_argument('-f', '--fixed_point', action='store_true', help='If set, the solver computes with fixed-point integers instead of rounded floats.')
+    parser.add_argument('-u', '--incremental_verification', action='store_true', help='If set, every solution of the experiments is verified item by item while it is computed, instead of re-solving the best eta values to verify them.')
+    parser.add_argument('-t', '--instrument', action='store_true', help='If set, the solver\'s hot path is instrumented on the best eta values and the counters are saved.')
+    parser.add_argument('-l', '--lp_solver', type=str, default='HIGHS', help='The LP solver: HIGHS (HiGHS in the process) or a PuLP solver, for example GUROBI_CMD.')
+    parser.add_argument('--cold_start', action='store_true', help='If set, the integral problem is solved without the warm start from the relaxation, which slows down some solvers (for example CBC).')
+    parser.add_argument('-w', '--max_flow', action='store_true', help='If set, the LP relaxation is solved as a maximum flow, without an external solver.')
+    parser.add_argument('-g', '--gap_budget', type=float, default=None, help='If set, the integral solution comes from a rounding heuristic when its gap to the LP relaxation is at most this many percent, otherwise from the exact MIP.')
+    parser.add_argument('--time_limit', type=float, default=60.0, help='Time limit of the local search of the rounding heuristic in seconds, shared by the components of a fragmented instance.')
+    parser.add_argument('-x', '--export', action='store_true', help='If set, the plots are saved as images next to the result files instead of being shown.')
     parser.add_argument('-c', '--clean', action='store_true', help='Deletes the cache and output files.')
     return parser.parse_args()
 
@@ -46,11 +55,24 @@ def validate_arguments(args):
             sys.exit(f'ERROR: The configuration with id [{args.config_id}] does not exist!')
 
     if args.manual:
+        from src.manual_input import MANUAL_INPUTS
         try:
             _ = MANUAL_INPUTS[args.config_id]
         except KeyError:
             sys.exit(f'ERROR: The manual input with id [{args.manual}] does not exist!')
 
+    if args.jobs < 1:
+        sys.exit('ERROR: The number of jobs should be at least 1!')
+
+    if args.cache_size < 0:
+        sys.exit('ERROR: The cache size should be at least 0!')
+
+    if args.gap_budget is not None and args.gap_budget < 0.0:
+        sys.exit('ERROR: The gap budget should be at least 0.0!')
+
+    if args.time_limit <= 0.0:
+        sys.exit('ERROR: The time limit should be positive!')
+
     if args.verbose < 0 or args.verbose > 2:
         sys.exit('ERROR: The verbose level must be [0, 1 or 2]!')
 
@@ -101,6 +123,15 @@ def save_metrics(metric_file, metrics, integrality_gaps):
             out_file.write(f"{metrics[idx]['Expenses']['min']};{metrics[idx]['Expenses']['max']};{metrics[idx]['Expenses']['avg']}\n")
 
 
+def save_instrumentation(instrumentation_file, rows):
+    with open(instrumentation_file, 'w+') as out_file:
+        out_file.write('RandomIteration;PredictionError;Eta;Bound;NumBuyersAvg;Method;Calls;Time;MeanTime;MaxTime;P99Time\n')
+        for (idx, error, eta, bound, num_buyers), counters in rows:
+            for name, counter in counters.items():
+                out_file.write(f"{idx};{error};{eta};{bound};{num_buyers};{name};{counter['calls']};{counter['time']};")
+                out_file.write(f"{counter.get('mean_time', '')};{counter.get('max_time', '')};{counter.get('p99_time', '')}\n")
+
+
 
 if __name__ == '__main__':
     # Execution setup
@@ -127,55 +158,125 @@ if __name__ == '__main__':
     # Files
     result_file = os.path.abspath(f'{DIR}/output/result_{manual_str}_{args.config_id}.csv')
     metric_file = os.path.abspath(f'{DIR}/metrics/instance_{manual_str}_{args.config_id}.csv')
-
+    instrumentation_file = os.path.abspath(f'{DIR}/metrics/instrumentation_{manual_str}_{args.config_id}.csv')
+    log_file = os.path.abspath(f'{DIR}/output/result_{manual_str}_{args.config_id}.log')
+
+
+    # Instance setup
+    from src.cache import ArrayCache, get_lp_cache_key
+    from src.instance_store import InstanceStore
+    from src.manual_input import MANUAL_INPUTS
+
+    # The LP solutions and the instances share the cache directory, its size limit and the entries in use
+    cache_entries_in_use = set()
+    lp_cache = ArrayCache(os.path.abspath(f'{DIR}/cache'), 'lp', args.cache_size * 2**20, cache_entries_in_use)
+    instance_store = InstanceStore(os.path.abspath(f'{DIR}/cache'), args.cache_size * 2**20, cache_entries_in_use)
+    datasets = []
+    instances = []
+    for random_idx in range(random_iterations):
+        if args.manual:
+            data = MANUAL_INPUTS[args.config_id]
+            instance = data
+        else:
+            # The shared configuration is not modified, every random iteration has its own seed
+            configuration = replace(CONFIGS[args.config_id], random_seed=CONFIGS[args.config_id].random_seed + random_idx)
+            data = instance_store.get(configuration, args.jobs)
+            instance = (configuration, instance_store.get_paths(configuration))
+        print(data)
+        metrics.append(data.metrics)
+        datasets.append(data)
+        instances.append(instance)
+
+    # The objective values computed by earlier (possibly interrupted) runs in the same mode, on the same instances and LP solutions
+    from src.result_log import ResultLog
+    result_log = ResultLog(log_file)
+    instance_hashes = [data.compact().get_hash() for data in datasets]
+    log_keys = [(instance_hash, get_lp_cache_key(instance_hash, args.gap_budget)) for instance_hash in instance_hashes]
+    objective_values = result_log.load(log_keys, args.stepped, args.fixed_point)
+    cells = [(random_idx, error, eta) for random_idx in range(random_iterations) for error in args.prediction_error for eta in eta_values]
+    missing_cells = [cell for cell in cells if cell not in objective_values]
+    if missing_cells and len(missing_cells) < len(cells):
+        print(f'{len(cells) - len(missing_cells)} of the {len(cells)} results are loaded from the result log.\n')
 
     # Execute several random iterations and average over the result
-    if not os.path.exists(result_file):
-        for random_idx in range(random_iterations):
-            # Instance setup
-            if args.manual:
-                data = MANUAL_INPUTS[args.config_id]
-            else:
-                configuration = CONFIGS[args.config_id]
-                configuration.random_seed += random_idx
-                data = InputGenerator(configuration).generate()
-            print(data)
-            metrics.append(data.metrics)
-
+    if missing_cells or not os.path.exists(result_file):
+        from src.bounded_allocation_solver import BoundedAllocationSolver
+        from src.experiment import get_work_units, run_work_units
+        from src.fixed_point_allocation_solver import FixedPointAllocationSolver
+        from src.lp_solver import LPSolverWrapper
+        from src.prediction import get_predictions
+        from src.verification import verify_solution
+
+        instrumentation_rows = []
+        offline_objective_values = []
+        for random_idx, data in enumerate(datasets):
             # LP solving
-            cache_file = os.path.abspath(f'{DIR}/cache/cache_{manual_str}_{args.config_id}_{random_idx}.json')
-            lp_solver = LPSolverWrapper(data, cache_file, verbose=args.verbose)
-            offline_objective_value = lp_solver.solve()
+            lp_solver = LPSolverWrapper(data, lp_cache, verbose=args.verbose, solver_name=args.lp_solver, warm_start=not args.cold_start, jobs=args.jobs, max_flow=args.max_flow, gap_budget=args.gap_budget, time_limit=args.time_limit)
+            try:
+                offline_objective_values.append(lp_solver.solve())
+            except ValueError as error:
+                sys.exit(f'ERROR: {error}')
             lp_solver.print_solution()
             integrality_gaps[random_idx] = lp_solver.get_integrality_gap()
-
-            # Iterate over several error rates in the prediction
-            for error in args.prediction_error:
-                include_prediction(data.items, error, lp_solver.integral_solution, data.config.random_seed)
-                solver = BoundedAllocationSolver(data, verbose=args.verbose)
-
-                # Run the solver on several eta values
+            instances[random_idx] = (instances[random_idx], lp_solver.integral_solution, data.config.random_seed)
+
+        # Run the solver on the missing error rates and eta values, the results of every work unit are logged as it finishes
+        work_units = get_work_units(random_iterations, args.prediction_error, eta_values, args.stepped, args.fixed_point, args.jobs, objective_values)
+        solved_errors = set()
+        for (random_idx, errors, unit_eta_values, _, _), (unit_results, report) in run_work_units(instances, work_units, args.jobs, args.incremental_verification):
+            if report is not None:
+                report.print_report()
+                if not report.valid:
+                    sys.exit('Verification failed!')
+
+            unit_cells = []
+            for error, unit_objective_values in zip(errors, unit_results):
+                for eta, objective_value in zip(unit_eta_values, unit_objective_values):
+                    objective_values[(random_idx, error, eta)] = objective_value
+                    unit_cells.append((random_idx, error, eta, objective_value))
+                solved_errors.add((random_idx, error))
+            result_log.append(unit_cells, log_keys, args.stepped, args.fixed_point)
+
+        for random_idx, (data, (_, integral_solution, seed)) in enumerate(zip(datasets, instances)):
+            offline_objective_value = offline_objective_values[random_idx]
+            prediction_matrix = get_predictions(data, args.prediction_error, integral_solution, seed)
+            for error, predictions in zip(args.prediction_error, prediction_matrix):
                 best_objective_value = -1
                 best_eta = -1
                 for eta in eta_values:
-                    objective_value = solver.solve(eta)
-                    gaps[random_idx][error][eta] = solver.get_solution_robustness(offline_objective_value)
+                    objective_value = objective_values[(random_idx, error, eta)]
+                    gaps[random_idx][error][eta] = ROUND(objective_value / offline_objective_value)
 
                     if objective_value > best_objective_value:
                         best_objective_value = objective_value
                         best_eta = eta
 
-                # Verify solution on the best eta value
-                solver.solve(best_eta)
+                # Verify solution on the best eta value of the errors solved in this run, unless every solution was verified
+                # item by item. The instrumentation needs the re-solve anyway.
+                if (random_idx, error) not in solved_errors or (args.incremental_verification and not args.instrument):
+                    continue
+                solver_class = FixedPointAllocationSolver if args.fixed_point else BoundedAllocationSolver
+                solver = solver_class(data, verbose=args.verbose, stepped=args.stepped, instrument=args.instrument)
+                solver.solve(best_eta, predictions)
+                instrumentation_rows.append(((random_idx, error, best_eta, data.bound, data.metrics['NumBuyers']['avg']), solver.get_instrumentation()))
                 solver.print_solution(error, offline_objective_value)
-                verify_solution(solver.assignment, data)
+                report = verify_solution(solver.assignment, data)
+                report.print_report()
+                if not report.valid:
+                    sys.exit('Verification failed!')
 
         # Save result
         save_result(result_file, gaps, eta_values)
         # Save metrics
         save_metrics(metric_file, metrics, integrality_gaps)
+        if args.instrument:
+            save_instrumentation(instrumentation_file, instrumentation_rows)
 
 
     # Display result
-    plot_result(result_file)
-    plot_metrics(metric_file)
+    from src.visualization import export_plots, plot_result, plot_metrics
+    if args.export:
+        export_plots([result_file], [metric_file])
+    else:
+        plot_result(result_file)
+        plot_metrics(metric_file)
@@ -0,0 +1,43 @@
+import argparse
+import glob
+import os
+import sys
+
+from src.visualization import export_plots
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Saves the plots of the result and metric files as images, without a display.')
+    parser.add_argument('files', type=str, nargs='*', help='The result and metric files to plot, by default all of them.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes rendering the plots.')
+    return parser.parse_args()
+
+
+def validate_arguments(args):
+    for file_name in args.files:
+        if not os.path.exists(file_name):
+            sys.exit(f'ERROR: The file [{file_name}] does not exist!')
+
+    if args.jobs < 1:
+        sys.exit('ERROR: The number of jobs should be at least 1!')
+
+
+def get_files(file_names):
+    # The metric files are named instance_*.csv, every other file is a result file
+    if not file_names:
+        file_names = sorted(glob.glob(f'{DIR}/output/result_*.csv')) + sorted(glob.glob(f'{DIR}/metrics/instance_*.csv'))
+    metric_files = [x for x in file_names if os.path.basename(x).startswith('instance_')]
+    result_files = [x for x in file_names if x not in metric_files]
+    return result_files, metric_files
+
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    validate_arguments(args)
+
+    result_files, metric_files = get_files(args.files)
+    for image_file in export_plots(result_files, metric_files, args.jobs):
+        print(f'Saved {image_file}')
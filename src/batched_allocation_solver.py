@@ -0,0 +1,193 @@
+from collections import defaultdict
+
+import numpy as np
+
+from src.checkpoints import Checkpoints
+from src.input import NO_PREDICTION
+from src.utils import FLOAT_PRECISION_DIGITS, ROUND
+from src.verification import IncrementalVerifier
+
+PRECISION = 10 ** -FLOAT_PRECISION_DIGITS
+
+
+# Runs the BoundedAllocationSolver for several eta values in one pass over the items.
+# The spent amounts are kept in an array of shape (num_eta, num_buyers). The equal allocation
+# over the levels has a closed form: when the allocation stops on level L, every buyer on a
+# level up to L is lifted to the lower bound of L, then gets the same amount m capped at the
+# upper bound of L.
+class BatchedAllocationSolver:
+    def __init__(self, data, verify=False):
+        self.data = data.compact()
+        self.bound = self.data.bound
+        self.budgets = self.data.budgets.astype(float)
+        self.prices = self.data.prices.tolist()
+        self.item_ptr = self.data.item_ptr.tolist()
+        self.level_ids = np.arange(self.bound)[None, :, None]
+
+        self.eta_values = np.zeros(0)
+        self.eta_ids = np.zeros(0, dtype=int)
+        self.spent = np.zeros((0, len(self.budgets)))
+        self.objective_values = []
+        self.item_fractions = []
+
+        # A replay with the same eta values (and keeping the assignment if asked) resumes from the latest
+        # checkpoint before the first changed prediction
+        self.checkpoints = Checkpoints(len(self.prices))
+        self.kept_assignment = False
+
+        # The item fraction invariants are checked for every eta value in batches of items, and the budgets after every
+        # solve, if asked
+        self.verifier = IncrementalVerifier(self.data) if verify else None
+
+
+    def _get_levels(self, spent, budgets):
+        levels = np.floor(spent / budgets * self.bound + PRECISION).astype(int)
+        return np.minimum(levels, self.bound)
+
+
+    def _get_level_ends(self, spent, budgets, levels):
+        # The amount needed to lift every buyer up to the upper bound of each level
+        upper_bounds = budgets * (self.level_ids + 1) / self.bound
+        on_or_below = levels[:, None, :] <= self.level_ids
+        return np.where(on_or_below, upper_bounds - spent[:, None, :], 0.0).sum(axis=2)
+
+
+    def _get_previous_level_end(self, level_ends, level_idx):
+        level_idx = level_idx[:, 0]
+        previous_end = level_ends[self.eta_ids, np.maximum(level_idx - 1, 0)]
+        return np.where(level_idx > 0, previous_end, 0.0)
+
+
+    def _get_level_state(self, spent, budgets, levels, level_idx):
+        # The spent amounts when the buyers start on the level and the amounts they can spend on it
+        on_or_below = levels <= level_idx
+        lower_bound = budgets * level_idx / self.bound
+        upper_bound = budgets * (level_idx + 1) / self.bound
+        base = np.where(on_or_below, np.maximum(spent, lower_bound), spent)
+        available_budgets = np.where(on_or_below, upper_bound - base, 0.0)
+        return on_or_below, base, available_budgets, upper_bound
+
+
+    def _get_share(self, available_budgets, amount):
+        # Water-filling: the share m for which the sum of min(m, available budget) is the amount
+        num_buyers = available_budgets.shape[1]
+        sorted_budgets = np.sort(available_budgets, axis=1)
+        cumulative = np.cumsum(sorted_budgets, axis=1)
+        totals = cumulative + sorted_budgets * np.arange(num_buyers - 1, -1, -1)
+        idx = np.minimum((totals < amount[:, None]).sum(axis=1), num_buyers - 1)
+        previous = np.where(idx > 0, cumulative[self.eta_ids, np.maximum(idx - 1, 0)], 0.0)
+        return (amount - previous) / (num_buyers - idx)
+
+
+    def _allocate_equally(self, spent, budgets, amount):
+        levels = self._get_levels(spent, budgets)
+        level_ends = self._get_level_ends(spent, budgets, levels)
+
+        # The level on which the allocation stops, if it is the bound all buyers are exhausted
+        level_idx = (level_ends < amount[:, None] - PRECISION).sum(axis=1)
+        exhausted = (level_idx == self.bound)
+        level_idx = np.minimum(level_idx, self.bound - 1)[:, None]
+
+        on_or_below, base, available_budgets, upper_bound = self._get_level_state(spent, budgets, levels, level_idx)
+        residual = amount - self._get_previous_level_end(level_ends, level_idx)
+        share = np.where(exhausted, np.inf, self._get_share(available_budgets, residual))
+        return np.where(on_or_below, np.minimum(base + share[:, None], upper_bound), spent)
+
+
+    def _get_needed_amount_to_reach_limit(self, spent, budgets):
+        levels = self._get_levels(spent, budgets)
+        level_ends = self._get_level_ends(spent, budgets, levels)
+
+        limit_level = np.minimum(np.floor(self.eta_values * self.bound + PRECISION).astype(int), self.bound)
+        all_levels = (limit_level == self.bound)
+        level_idx = np.minimum(limit_level, self.bound - 1)[:, None]
+
+        # On the level of eta, every buyer gets the same amount until the last one reaches eta
+        on_or_below, base, available_budgets, _ = self._get_level_state(spent, budgets, levels, level_idx)
+        needed_share = np.where(on_or_below, budgets * self.eta_values[:, None] - base, 0.0).max(axis=1)
+        needed_share = np.maximum(needed_share, 0.0)
+        needed = self._get_previous_level_end(level_ends, level_idx)
+        needed = needed + np.minimum(needed_share[:, None], available_budgets).sum(axis=1)
+        return np.where(all_levels, level_ends[:, -1], needed)
+
+
+    def _allocate_item(self, price, prediction, buyer_ids):
+        budgets = self.budgets[buyer_ids]
+        spent = self.spent[:, buyer_ids]
+
+        if prediction == NO_PREDICTION:
+            self.spent[:, buyer_ids] = self._allocate_equally(spent, budgets, self.eta_values * price)
+            return
+
+        # Allocate the item equally until all interested buyers spent at least eta of their budget
+        needed_amount = np.minimum(self._get_needed_amount_to_reach_limit(spent, budgets), price)
+        new_spent = self._allocate_equally(spent, budgets, needed_amount)
+        self.spent[:, buyer_ids] = new_spent
+        remaining_amount = np.maximum(price - (new_spent - spent).sum(axis=1), 0.0)
+
+        # The predicted buyer gets its 1 - eta fraction as far as its budget allows
+        available_budget = np.maximum(self.budgets[prediction] - self.spent[:, prediction], 0.0)
+        prediction_amount = np.minimum(np.minimum(remaining_amount, (1.0 - self.eta_values) * price), available_budget)
+        self.spent[:, prediction] += prediction_amount
+        remaining_amount = remaining_amount - prediction_amount
+
+        self.spent[:, buyer_ids] = self._allocate_equally(self.spent[:, buyer_ids], budgets, remaining_amount)
+
+
+    def _resume(self, eta_values, predictions, keep_assignment):
+        # Returns the first item to replay, the items from there on lose their fractions
+        resumable = np.array_equal(eta_values, self.eta_values) and self.kept_assignment >= keep_assignment
+        start, state = self.checkpoints.resume(predictions, resumable)
+        if start > 0:
+            self.spent = state
+            self.item_fractions = [x for x in self.item_fractions if x[0] < start]
+        else:
+            self.eta_values = eta_values
+            self.eta_ids = np.arange(len(self.eta_values))
+            self.spent = np.zeros((len(self.eta_values), len(self.budgets)))
+            self.item_fractions = []
+        self.kept_assignment = keep_assignment
+        return start
+
+
+    def solve(self, eta_values, predictions=None, keep_assignment=False):
+        eta_values = np.array([ROUND(eta) for eta in eta_values], dtype=float)
+        predictions = self.data.predictions if predictions is None else predictions
+        start = self._resume(eta_values, predictions, keep_assignment)
+        predictions = predictions.tolist()
+
+        for item_id in range(start, len(self.prices)):
+            self.checkpoints.save(item_id, self.spent.copy)
+
+            price = self.prices[item_id]
+            buyer_ids = self.data.item_buyers[self.item_ptr[item_id]:self.item_ptr[item_id + 1]]
+            if len(buyer_ids) == 0:
+                continue
+            spent = self.spent[:, buyer_ids]
+            self._allocate_item(price, predictions[item_id], buyer_ids)
+            fractions = (self.spent[:, buyer_ids] - spent) / price
+            if keep_assignment:
+                self.item_fractions.append((item_id, buyer_ids, fractions))
+            if self.verifier is not None:
+                self.verifier.check_item_arrays(item_id, buyer_ids, fractions)
+
+        if self.verifier is not None:
+            self.verifier.check_batch()
+            self.verifier.check_spent(self.spent)
+
+        # The objective value is the total amount spent by the buyers
+        self.objective_values = [ROUND(x) for x in self.spent.sum(axis=1)]
+        return self.objective_values
+
+
+    def get_assignment(self, eta_idx):
+        assignment = [defaultdict(lambda: 0) for _ in self.budgets]
+        for item_id, buyer_ids, fractions in self.item_fractions:
+            for buyer_id, fraction in zip(buyer_ids, fractions[eta_idx]):
+                if fraction > PRECISION:
+                    assignment[int(buyer_id)][item_id] = ROUND(float(fraction))
+        return assignment
+
+
+    def get_solution_robustness(self, offline_objective_value):
+        return [ROUND(x / offline_objective_value) for x in self.objective_values]
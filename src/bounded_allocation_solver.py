@@ -1,44 +1,98 @@
+import time
+
+from bisect import bisect_right
 from collections import defaultdict
-from src.utils import ROUND
+from dataclasses import dataclass
+from src.checkpoints import Checkpoints
+from src.input import Item, NO_PREDICTION
+from src.instrumentation import Instrumentation
+from src.utils import FLOAT_PRECISION_DIGITS, ROUND
+from src.verification import IncrementalVerifier
+
+PRECISION = 10 ** -FLOAT_PRECISION_DIGITS
+
+
+@dataclass
+class AllocationRecord:
+    item_id: int
+    allocation: dict # Buyer id -> allocated fraction of the item
+    objective_value: float # Running objective value after the item
+    latency: float # Seconds taken by the allocation decision
 
 
 class BoundedAllocationSolver:
-    def __init__(self, data, verbose):
-        self.buyers = data.buyers
-        self.items = data.items
-        self.bound = data.bound
+    def __init__(self, data, verbose, stepped=False, verify=False, instrument=False):
+        self.data = data.compact()
+        self.budgets = self.data.budgets.tolist()
+        # The items of the input are copied to lists by the first solve, solve_stream takes them from the stream alone
+        self.prices = None
+        self.item_ptr = None
+        self.item_buyers = None
+        self.bound = self.data.bound
         self.verbose = verbose
+        self.stepped = stepped
+        # The item fraction invariants are checked after every item of every solve, and the budgets after every solve, if asked
+        self.verifier = IncrementalVerifier(self.data) if verify else None
 
-        self.eta = 0.0
         self.objective_value = 0
         self.allocation_step = ROUND(1 / (self.bound * 10))
+        # The lower budget fraction bound of each level, the last one (1.0) marks the exhausted buyers
+        self.level_bounds = [ROUND(idx / self.bound) for idx in range(self.bound + 1)]
+        self._set_eta(0.0)
+        # The rounded available budgets on a level differ from the exact ones by less than the tolerance
+        self.tolerance = 2 * PRECISION * (max(self.budgets, default=0.0) + 1)
+
+        # A replay with the same eta resumes from the latest checkpoint before the first changed prediction
+        self.checkpoints = Checkpoints(len(self.data.prices))
+        self.replayed_eta = None
+
+        # The stepped loop calls _all_buyers_spent_enough once per iteration, the rounds of _allocate_on_level are counted
+        # in its loop
+        self.instrumentation = None
+        if instrument:
+            self.instrumentation = Instrumentation()
+            self.instrumentation.instrument(self, [
+                '_allocate_item', '_allocate_equally', '_allocate_on_level', '_get_buyers',
+                '_update_buyer_level', '_update_level_sets', '_all_buyers_spent_enough'
+            ], recorded_names=['_allocate_item'])
         self._init_solver()
 
 
     def _init_solver(self):
-        for idx in range(len(self.buyers)):
-            self.buyers[idx].reset()
+        self.spent = [0.0 for _ in self.budgets]
+        self.budget_fractions = [0.0 for _ in self.budgets]
 
-        self.levels = [set() for _ in range(self.bound + 1)]
-        for buyer in self.buyers:
-            self.levels[0].add(buyer.id)
+        # The level of each buyer, a buyer on level bound has exhausted its budget
+        self.buyer_levels = [0 for _ in self.budgets]
 
-        self.assignment = [defaultdict(lambda: 0) for _ in self.buyers]
+        self.assignment = [defaultdict(lambda: 0) for _ in self.budgets]
+        self.item_assignment = defaultdict(lambda: 0)
+        self.checkpoints.clear()
+        self.replayed_eta = None
 
 
-    def _update_buyer_level(self, buyer_id):
-        for idx, level in enumerate(self.levels):
-            if buyer_id in level:
-                self.levels[idx].remove(buyer_id)
-                break
+    def _set_eta(self, eta):
+        self.eta = ROUND(eta)
+        # The fraction of the predicted buyer and the level of eta are the same for every item
+        self.prediction_fraction = ROUND(1.0 - self.eta)
+        self.limit_level = bisect_right(self.level_bounds, self.eta) - 1
+
 
-        fraction = self.buyers[buyer_id].budget_fraction
-        for idx in range(self.bound):
-            lower_bound = ROUND(idx / self.bound)
-            upper_bound = ROUND((idx + 1) / self.bound)
-            if lower_bound <= fraction and fraction < upper_bound:
-                self.levels[idx].add(buyer_id)
-                break
+    def _start_solve(self, eta):
+        self._set_eta(eta)
+        # The counters cover the items of this solve only, also when it resumes from a checkpoint
+        if self.instrumentation is not None:
+            self.instrumentation.reset()
+
+
+    def _spend(self, buyer_id, amount):
+        self.spent[buyer_id] = ROUND(self.spent[buyer_id] + amount)
+        self.budget_fractions[buyer_id] = ROUND(self.spent[buyer_id] / self.budgets[buyer_id])
+
+
+    def _update_buyer_level(self, buyer_id):
+        fraction = self.budget_fractions[buyer_id]
+        self.buyer_levels[buyer_id] = bisect_right(self.level_bounds, fraction) - 1
 
 
     def _allocate_for_one_buyer(self, item, remaining_fraction):
@@ -51,17 +105,17 @@ class BoundedAllocationSolver:
             return self.eta
 
         # The predicted buyer cannot buy the item, try to allocate it to other buyers
-        if self.buyers[item.prediction].budget_fraction >= 1.0:
+        if self.budget_fractions[item.prediction] >= 1.0:
             return remaining_fraction
 
-        prediction_fraction = ROUND(1.0 - self.eta)
+        prediction_fraction = self.prediction_fraction
         new_fraction = ROUND(remaining_fraction - prediction_fraction)
 
         if remaining_fraction < prediction_fraction:
             prediction_fraction = remaining_fraction
             new_fraction = 0.0
 
-        available_budget = self.buyers[item.prediction].budget - self.buyers[item.prediction].spent
+        available_budget = self.budgets[item.prediction] - self.spent[item.prediction]
         price_fraction = ROUND(item.price * prediction_fraction)
 
         if price_fraction > available_budget:
@@ -69,73 +123,104 @@ class BoundedAllocationSolver:
             price_fraction = available_budget
             new_fraction = ROUND(remaining_fraction - prediction_fraction)
 
-        self.assignment[item.prediction][item.id] = ROUND(self.assignment[item.prediction][item.id] + prediction_fraction)
-        self.buyers[item.prediction].spend(price_fraction)
+        self.item_assignment[item.prediction] = ROUND(self.item_assignment[item.prediction] + prediction_fraction)
+        self._spend(item.prediction, price_fraction)
         self._update_buyer_level(item.prediction)
 
         return new_fraction
 
 
     def _get_buyers(self, item):
-        for idx, level in enumerate(self.levels):
-            buyers = level.intersection(item.interested_buyers)
-            if len(buyers) != 0:
-                return idx, buyers
-        return -1, set()
+        min_level = self.bound + 1
+        buyers = set()
+        for buyer_id in item.interested_buyers:
+            level = self.buyer_levels[buyer_id]
+            if level < min_level:
+                min_level = level
+                buyers = {buyer_id}
+            elif level == min_level:
+                buyers.add(buyer_id)
 
+        if len(buyers) == 0:
+            return -1, set()
+        return min_level, buyers
 
-    def _get_min_max_price(self, buyer_ids, fraction_bound):
-        max_price = float('inf')
-        for buyer_id in buyer_ids:
-            available_fraction = ROUND(fraction_bound - self.buyers[buyer_id].budget_fraction)
-            available_budget = ROUND(self.buyers[buyer_id].budget * available_fraction)
-            if available_budget < max_price:
-                max_price = available_budget
-        return max_price
+
+    def _get_available_budget(self, buyer_id, fraction_bound):
+        available_fraction = ROUND(fraction_bound - self.budget_fractions[buyer_id])
+        return ROUND(self.budgets[buyer_id] * available_fraction)
 
 
     def _allocate_on_level(self, item, remaining_fraction, level_idx, buyer_ids):
-        fraction_bound = ROUND((level_idx + 1) / self.bound)
-        exhausted_buyer_ids = set()
-        last_round = False
+        fraction_bound = self.level_bounds[level_idx + 1]
+
+        # The item is split equally in rounds: a round caps the share at the least budget a remaining buyer can spend
+        # on the level, then the buyers who reached the level bound leave. The buyers are sorted once by the budget they
+        # can spend on the level, which differs from their rounded available budget by less than the tolerance. Only the
+        # buyers tied with the first remaining one can cap a round or leave after it, so only they get the shares round
+        # by round, the others get the sum of the shares when the item is split.
+        keys = sorted((self.budgets[buyer_id] * fraction_bound - self.spent[buyer_id], buyer_id) for buyer_id in buyer_ids)
+        remaining = [True for _ in keys]
+        num_buyers = len(keys)
+        first = 0
+        tied = 0
+        amount = 0.0
+        fraction = 0.0
+
+        while num_buyers != 0:
+            if self.instrumentation is not None:
+                self.instrumentation.count('_allocate_on_level_rounds')
 
-        while len(buyer_ids) != 0:
-            # Split the item equally among the buyers
-            fraction_per_buyer = ROUND(remaining_fraction / len(buyer_ids))
+            # Split the rest of the item equally among the remaining buyers
+            fraction_per_buyer = ROUND(remaining_fraction / num_buyers)
             price_fraction_per_buyer = ROUND(item.price * fraction_per_buyer)
 
-            # Max refers to the min spent amount with which at least one buyer changes level
-            max_price_per_buyer = self._get_min_max_price(buyer_ids, fraction_bound)
-            max_fraction_per_buyer = ROUND(max_price_per_buyer / item.price)
+            # Max refers to the min spent amount with which at least one buyer changes level, it is computed from the
+            # tied buyers (who get the shares of the previous rounds first) only if its lower bound does not suffice
+            max_price_per_buyer = keys[first][0] - amount - self.tolerance
+            if price_fraction_per_buyer > max_price_per_buyer:
+                while tied < len(keys) and keys[tied][0] <= keys[first][0] + 2 * self.tolerance:
+                    if amount > 0.0:
+                        self._add_share(keys[tied][1], fraction, amount)
+                    tied += 1
+                max_price_per_buyer = min(self._get_available_budget(keys[idx][1], fraction_bound) for idx in range(first, tied) if remaining[idx])
 
             # The item can be evenly split among the buyers without jumping to higher levels
             if price_fraction_per_buyer <= max_price_per_buyer:
-                last_round = True
-            else: # At lest one buyer jumps to a higher level with an equal item part
-                fraction_per_buyer = max_fraction_per_buyer
-                price_fraction_per_buyer = max_price_per_buyer
-
-            for buyer_id in buyer_ids:
-                self.assignment[buyer_id][item.id] = ROUND(self.assignment[buyer_id][item.id] + fraction_per_buyer)
-                self.buyers[buyer_id].spend(price_fraction_per_buyer)
-                if self.buyers[buyer_id].budget_fraction >= fraction_bound:
-                    exhausted_buyer_ids.add(buyer_id)
-
-            if last_round:
+                for idx in range(first, len(keys)):
+                    if idx >= tied:
+                        self._add_share(keys[idx][1], fraction + fraction_per_buyer, amount + price_fraction_per_buyer)
+                    elif remaining[idx]:
+                        self._add_share(keys[idx][1], fraction_per_buyer, price_fraction_per_buyer)
                 return 0.0
 
-            remaining_fraction = ROUND(remaining_fraction - (len(buyer_ids) * fraction_per_buyer))
-            buyer_ids = buyer_ids.difference(exhausted_buyer_ids)
+            # At least one buyer jumps to a higher level with an equal item part
+            max_fraction_per_buyer = ROUND(max_price_per_buyer / item.price)
+            amount = ROUND(amount + max_price_per_buyer)
+            fraction = ROUND(fraction + max_fraction_per_buyer)
+            remaining_fraction = ROUND(remaining_fraction - (num_buyers * max_fraction_per_buyer))
+            for idx in range(first, tied):
+                if remaining[idx]:
+                    self._add_share(keys[idx][1], max_fraction_per_buyer, max_price_per_buyer)
+                    if self.budget_fractions[keys[idx][1]] >= fraction_bound:
+                        remaining[idx] = False
+                        num_buyers -= 1
+            while first < tied and not remaining[first]:
+                first += 1
 
         return remaining_fraction
 
 
+    def _add_share(self, buyer_id, fraction, amount):
+        self.item_assignment[buyer_id] = ROUND(self.item_assignment[buyer_id] + fraction)
+        self._spend(buyer_id, amount)
+
+
     def _update_level_sets(self, level_idx, buyer_ids):
-        fraction_bound = ROUND((level_idx + 1) / self.bound)
+        fraction_bound = self.level_bounds[level_idx + 1]
         for buyer_id in buyer_ids:
-            if self.buyers[buyer_id].budget_fraction >= fraction_bound:
-                self.levels[level_idx].remove(buyer_id)
-                self.levels[level_idx + 1].add(buyer_id)
+            if self.budget_fractions[buyer_id] >= fraction_bound:
+                self.buyer_levels[buyer_id] = level_idx + 1
 
 
     def _allocate_equally(self, item, remaining_fraction):
@@ -156,58 +241,185 @@ class BoundedAllocationSolver:
     def _needed_amount_to_reach_limit(self, buyer_ids):
         amount = 0.0
         for buyer_id in buyer_ids:
-            if self.buyers[buyer_id].budget_fraction < self.eta:
-                amount += (self.eta - self.buyers[buyer_id].budget_fraction) * self.buyers[buyer_id].budget
+            if self.budget_fractions[buyer_id] < self.eta:
+                amount += (self.eta - self.budget_fractions[buyer_id]) * self.budgets[buyer_id]
         return ROUND(amount)
 
 
     def _all_buyers_spent_enough(self, buyer_ids):
         for buyer_id in buyer_ids:
-            if self.buyers[buyer_id].budget_fraction < self.eta:
+            if self.budget_fractions[buyer_id] < self.eta:
                 return False
         return True
 
 
+    def _allocate_to_reach_limit(self, item):
+        remaining_fraction = 1.0
+        limit_level = self.limit_level
+
+        # Fill the levels below the level of eta, every buyer on them spent less than eta
+        level_idx, buyer_ids = self._get_buyers(item)
+        while remaining_fraction > 0.0 and level_idx != -1 and level_idx < limit_level:
+            remaining_fraction = self._allocate_on_level(item, remaining_fraction, level_idx, buyer_ids)
+            self._update_level_sets(level_idx, buyer_ids)
+            level_idx, buyer_ids = self._get_buyers(item)
+
+        # On the level of eta, every buyer gets the same amount until the last one reaches eta
+        if remaining_fraction > 0.0 and level_idx == limit_level and limit_level < self.bound:
+            # The rounded available budgets are computed only for the buyers within the tolerance of the largest
+            # one, and of the needed price
+            fraction_bound = self.level_bounds[level_idx + 1]
+            keys = [(self.budgets[buyer_id] * self.eta - self.spent[buyer_id], buyer_id) for buyer_id in buyer_ids]
+            max_key = max(keys)[0]
+            needed_price = max(self._get_available_budget(buyer_id, self.eta) for key, buyer_id in keys if key >= max_key - 2 * self.tolerance)
+            if needed_price > 0.0:
+                needed_fraction = 0.0
+                for buyer_id in buyer_ids:
+                    if self.budgets[buyer_id] * fraction_bound - self.spent[buyer_id] - self.tolerance >= needed_price:
+                        needed_fraction += needed_price
+                    else:
+                        needed_fraction += min(needed_price, self._get_available_budget(buyer_id, fraction_bound))
+                needed_fraction = min(ROUND(needed_fraction / item.price), remaining_fraction)
+
+                unallocated_fraction = self._allocate_on_level(item, needed_fraction, level_idx, buyer_ids)
+                self._update_level_sets(level_idx, buyer_ids)
+                remaining_fraction = ROUND(remaining_fraction - needed_fraction + unallocated_fraction)
+
+        return ROUND(1.0 - remaining_fraction)
+
+
+    def _allocate_to_reach_limit_stepped(self, item):
+        amount = self._needed_amount_to_reach_limit(item.interested_buyers)
+        fraction = 1.0
+
+        if amount >= item.price:
+            self._allocate_equally(item, fraction)
+        else:
+            fraction = ROUND(amount / item.price)
+            self._allocate_equally(item, fraction)
+
+            max_steps = int((1 - fraction) / self.allocation_step)
+            for _ in range(max_steps):
+                if self._all_buyers_spent_enough(item.interested_buyers):
+                    break
+                self._allocate_equally(item, self.allocation_step)
+                fraction = ROUND(fraction + self.allocation_step)
+
+        return fraction
+
+
     def _calculate_objective_value(self):
         self.objective_value = 0.0
         for sold_items in self.assignment:
             for item_id, fraction in sold_items.items():
-                self.objective_value += self.items[item_id].price * fraction
+                self.objective_value += self.prices[item_id] * fraction
         self.objective_value = ROUND(self.objective_value)
 
 
-    def solve(self, eta):
-        self.eta = ROUND(eta)
-        self._init_solver()
+    def _allocate_item(self, item):
+        self.item_assignment = defaultdict(lambda: 0)
 
-        for item in self.items:
-            if item.prediction is None:
-                self._allocate_equally(item, self.eta)
+        if item.prediction is None:
+            self._allocate_equally(item, self.eta)
+        else:
+            # Allocate the item equally until all interested buyers spent at least eta of their budget
+            if self.stepped:
+                fraction = self._allocate_to_reach_limit_stepped(item)
             else:
-                amount = self._needed_amount_to_reach_limit(item.interested_buyers)
-                fraction = 1.0
-
-                if amount >= item.price:
-                    self._allocate_equally(item, fraction)
-                else:
-                    fraction = ROUND(amount / item.price)
-                    self._allocate_equally(item, fraction)
-
-                    max_steps = int((1 - fraction) / self.allocation_step)
-                    for _ in range(max_steps):
-                        if self._all_buyers_spent_enough(item.interested_buyers):
-                            break
-                        self._allocate_equally(item, self.allocation_step)
-                        fraction = ROUND(fraction + self.allocation_step)
-
-                remaining_fraction = ROUND(1 - fraction)
-                remaining_fraction = self._allocate_for_one_buyer(item, remaining_fraction)
-                self._allocate_equally(item, remaining_fraction)
+                fraction = self._allocate_to_reach_limit(item)
+
+            remaining_fraction = ROUND(1 - fraction)
+            remaining_fraction = self._allocate_for_one_buyer(item, remaining_fraction)
+            self._allocate_equally(item, remaining_fraction)
+
+        if self.verifier is not None:
+            self.verifier.check_item(item.id, self.item_assignment)
+        return self.item_assignment
+
+
+    def _init_items(self):
+        if self.prices is None:
+            self.prices = self.data.prices.tolist()
+            self.item_ptr = self.data.item_ptr.tolist()
+            self.item_buyers = self.data.item_buyers.tolist()
+
+
+    def _get_items(self, predictions, start=0):
+        predictions = predictions.tolist()
+        for item_id in range(start, len(self.prices)):
+            item = Item(item_id, self.prices[item_id], self.item_buyers[self.item_ptr[item_id]:self.item_ptr[item_id + 1]])
+            if predictions[item_id] != NO_PREDICTION:
+                item.prediction = predictions[item_id]
+            yield item
+
+
+    def _get_state(self):
+        return self.spent[:], self.budget_fractions[:], self.buyer_levels[:]
+
+
+    def _set_state(self, state):
+        self.spent, self.budget_fractions, self.buyer_levels = state
+
+
+    def _save_checkpoint(self, item_id):
+        self.checkpoints.save(item_id, self._get_state)
+
+
+    def _resume(self, predictions):
+        # Returns the first item to replay, the items from there on lose their assignment
+        start, state = self.checkpoints.resume(predictions, self.replayed_eta == self.eta)
+        if start > 0:
+            self._set_state(state)
+            for item_id in range(start, len(self.prices)):
+                for buyer_id in self.item_buyers[self.item_ptr[item_id]:self.item_ptr[item_id + 1]]:
+                    self.assignment[buyer_id].pop(item_id, None)
+        else:
+            self._init_solver()
+        self.replayed_eta = self.eta
+        return start
+
+
+    def solve(self, eta, predictions=None):
+        # The predictions are a row of the prediction matrix, by default the ones stored in the input
+        self._start_solve(eta)
+        self._init_items()
+        predictions = self.data.predictions if predictions is None else predictions
+        start = self._resume(predictions)
+
+        for item in self._get_items(predictions, start):
+            self._save_checkpoint(item.id)
+            for buyer_id, fraction in self._allocate_item(item).items():
+                self.assignment[buyer_id][item.id] = fraction
 
         self._calculate_objective_value()
+        if self.verifier is not None:
+            self.verifier.check_spent(self.spent)
         return self.objective_value
 
 
+    def solve_stream(self, eta, items):
+        # Decides on each item as it arrives, only the state of the buyers is kept
+        self._start_solve(eta)
+        self._init_solver()
+        self.objective_value = 0.0
+
+        for item in items:
+            start = time.perf_counter()
+            allocation = dict(self._allocate_item(item))
+            self.objective_value = ROUND(self.objective_value + item.price * sum(allocation.values()))
+            yield AllocationRecord(item.id, allocation, self.objective_value, time.perf_counter() - start)
+
+        if self.verifier is not None:
+            self.verifier.check_spent(self.spent)
+
+
+    def get_instrumentation(self):
+        # Calls and time (including nested calls) per instrumented method of the last solve, and the level rounds
+        if self.instrumentation is None:
+            return {}
+        return self.instrumentation.get_counters()
+
+
     def get_solution_robustness(self, offline_objective_value):
         return ROUND(self.objective_value / offline_objective_value)
 
@@ -0,0 +1,110 @@
+import os
+import tempfile
+
+import numpy as np
+
+
+def get_lp_cache_key(instance_hash, gap_budget=None):
+    # The LP solutions are cached by the content hash of the instance, the heuristic integral solutions also by the gap budget they satisfy
+    return instance_hash if gap_budget is None else f'{instance_hash}_gap{gap_budget}'
+
+
+
+# Stores named NumPy arrays under a key as .npy files, which are loaded memory mapped.
+# The entry '<prefix>_<key>' consists of the files '<prefix>_<key>.<name>.npy' and of the
+# index file '<prefix>_<key>.npy' listing the names. The index is written last, so only
+# complete entries are found, and its modification time marks the last use of the entry.
+# The files are written under unique temporary names and renamed, so concurrent saves of
+# the same entry do not mix. When the files of the cache directory grow over the size limit
+# (in bytes), the least recently used entries are evicted, except the entries loaded or saved
+# by this run. The caches of the same directory share the limit, so they should share the
+# set of the entries in use too.
+class ArrayCache:
+    def __init__(self, cache_dir, prefix, size_limit, in_use=None):
+        self.cache_dir = cache_dir
+        self.prefix = prefix
+        self.size_limit = size_limit
+        self.in_use = set() if in_use is None else in_use
+
+
+    def _get_path(self, key, name=None):
+        if name is None:
+            return os.path.join(self.cache_dir, f'{self.prefix}_{key}.npy')
+        return os.path.join(self.cache_dir, f'{self.prefix}_{key}.{name}.npy')
+
+
+    def _get_entry_paths(self, index_path):
+        names = np.load(index_path)
+        base_path = index_path[:-len('.npy')]
+        return [f'{base_path}.{name}.npy' for name in names] + [index_path]
+
+
+    def _write(self, path, array):
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, prefix=f'{os.path.basename(path)}.', suffix='.tmp', delete=False) as out_file:
+            np.save(out_file, np.asarray(array))
+        os.replace(out_file.name, path)
+
+
+    def get_paths(self, key):
+        # The paths of the arrays of an entry, or None
+        index_path = self._get_path(key)
+        if not os.path.exists(index_path):
+            return None
+        return {str(name): self._get_path(key, name) for name in np.load(index_path)}
+
+
+    def load(self, key):
+        index_path = self._get_path(key)
+        if not os.path.exists(index_path):
+            return None
+
+        arrays = {}
+        try:
+            os.utime(index_path)
+            for name in np.load(index_path):
+                arrays[str(name)] = np.load(self._get_path(key, name), mmap_mode='r')
+        except FileNotFoundError:
+            # Evicted by a concurrent run
+            return None
+        self.in_use.add(index_path)
+        return arrays
+
+
+    def save(self, key, arrays):
+        for name, array in arrays.items():
+            self._write(self._get_path(key, name), array)
+
+        index_path = self._get_path(key)
+        self._write(index_path, np.array(list(arrays.keys())))
+        self.in_use.add(index_path)
+        self._evict()
+
+
+    def _evict(self):
+        # The index files are the .npy files without a name between the key and the extension
+        entries = []
+        total_size = 0
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith('.npy') and file_name.count('.') == 1:
+                index_path = os.path.join(self.cache_dir, file_name)
+                try:
+                    paths = [x for x in self._get_entry_paths(index_path) if os.path.exists(x)]
+                    size = sum(os.path.getsize(x) for x in paths)
+                    entries.append((os.path.getmtime(index_path), index_path, paths, size))
+                except FileNotFoundError:
+                    # Evicted by a concurrent run
+                    continue
+                total_size += size
+
+        for _, index_path, paths, size in sorted(entries):
+            if total_size <= self.size_limit:
+                break
+            if index_path in self.in_use:
+                continue
+            # The index goes first, so a partially removed entry is never found. A concurrent run may remove it too.
+            for path in [index_path] + [x for x in paths if x != index_path]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total_size -= size
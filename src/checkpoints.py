@@ -0,0 +1,44 @@
+import numpy as np
+
+
+# The states of a solver saved during a replay of the items, so a replay with changed predictions resumes
+# from the latest checkpoint before the first item whose prediction changed. The state is saved every
+# interval items (at most 64 times). The solver decides if a replay can resume at all (for example only
+# with the same eta values) and what its state is.
+class Checkpoints:
+    def __init__(self, num_items):
+        self.num_items = num_items
+        self.interval = max(1, -(-num_items // 64))
+        self.checkpoints = []
+        self.replayed_predictions = None
+
+
+    def clear(self):
+        self.checkpoints = []
+
+
+    def save(self, item_id, get_state):
+        if item_id % self.interval == 0:
+            self.checkpoints.append((item_id, get_state()))
+
+
+    def resume(self, predictions, resumable):
+        # Returns the first item to replay and the state saved before it. The replay starts over (from item 0,
+        # without a state) if it is not resumable or no checkpoint precedes the first changed prediction.
+        predictions = np.array(predictions)
+        start = 0
+        state = None
+        if resumable and self.replayed_predictions is not None:
+            changed = np.flatnonzero(predictions != self.replayed_predictions)
+            first_changed = changed[0] if len(changed) > 0 else self.num_items
+            while self.checkpoints and self.checkpoints[-1][0] > first_changed:
+                self.checkpoints.pop()
+
+            if self.checkpoints:
+                start, state = self.checkpoints.pop()
+
+        if start == 0:
+            self.checkpoints = []
+            state = None
+        self.replayed_predictions = predictions
+        return start, state
@@ -0,0 +1,94 @@
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from src.batched_allocation_solver import BatchedAllocationSolver
+from src.bounded_allocation_solver import BoundedAllocationSolver
+from src.fixed_point_allocation_solver import FixedPointAllocationSolver
+from src.instance_store import load_instance
+from src.prediction import get_predictions
+
+# The batched solver replays all the eta values at once at a cost that barely grows with their number, but it only
+# beats a replay per eta value of the scalar solver from about 16 eta values on (measured on config 3 and the scaled
+# cases of the benchmark)
+MIN_BATCHED_ETA_VALUES = 16
+
+# The instances of the worker process: (data, integral solution, prediction seed) per random iteration
+_instances = []
+
+
+def _init_worker(instances):
+    # The generated instances are passed by their configuration and the paths of their stored arrays, and loaded
+    # read-only instead of pickling their arrays to every worker
+    global _instances
+    _instances = []
+    for instance, integral_solution, seed in instances:
+        if isinstance(instance, tuple):
+            instance = load_instance(*instance)
+        _instances.append((instance, integral_solution, seed))
+
+
+def _is_batched(eta_values, stepped, fixed_point):
+    return not stepped and not fixed_point and len(eta_values) >= MIN_BATCHED_ETA_VALUES
+
+
+def _solve_work_unit(work_unit, verify):
+    # The errors are replayed one after the other on the same solver, which resumes each replay
+    # from the checkpoint before the first item whose prediction changed. With verify, the solver
+    # checks every item of every replay, and the report of the violations is returned too (or None).
+    random_idx, errors, eta_values, stepped, fixed_point = work_unit
+    data, integral_solution, seed = _instances[random_idx]
+
+    batched = _is_batched(eta_values, stepped, fixed_point)
+    if batched:
+        solver = BatchedAllocationSolver(data, verify=verify)
+    else:
+        solver_class = FixedPointAllocationSolver if fixed_point else BoundedAllocationSolver
+        solver = solver_class(data, verbose=0, stepped=stepped, verify=verify)
+
+    results = []
+    for predictions in get_predictions(data, errors, integral_solution, seed):
+        if batched:
+            results.append(solver.solve(eta_values, predictions))
+        else:
+            results.append([solver.solve(eta, predictions) for eta in eta_values])
+    return results, solver.verifier.report if verify else None
+
+
+def get_work_units(random_iterations, prediction_errors, eta_values, stepped, fixed_point, jobs, completed=()):
+    # The scalar solvers need a replay per eta value, one batched replay covers all of them (with enough eta values, and
+    # neither stepped nor fixed-point).
+    # Only the errors with a cell missing from the completed (random_idx, error, eta) cells are replayed.
+    # The errors of an instance share a work unit in increasing order, so consecutive replays share the longest prefix
+    # (the mispredicted items of an error are mispredicted for the higher ones too), but they are split into as many
+    # chains as needed to keep the jobs busy.
+    eta_groups = [eta_values] if _is_batched(eta_values, stepped, fixed_point) else [[eta] for eta in eta_values]
+    missing_errors = {}
+    for random_idx in range(random_iterations):
+        for group_idx, unit_eta_values in enumerate(eta_groups):
+            errors = [error for error in sorted(prediction_errors) if any((random_idx, error, eta) not in completed for eta in unit_eta_values)]
+            if errors:
+                missing_errors[(random_idx, group_idx)] = errors
+
+    work_units = []
+    for (random_idx, group_idx), errors in missing_errors.items():
+        num_chains = min(len(errors), -(-jobs // len(missing_errors)))
+        for error_chain in np.array_split(errors, num_chains):
+            work_units.append((random_idx, error_chain.tolist(), eta_groups[group_idx], stepped, fixed_point))
+    return work_units
+
+
+def run_work_units(instances, work_units, jobs, verify=False):
+    # Yields the work units with their results and verification reports as they finish, so the results can be saved
+    # before the whole run ends
+    if jobs == 1:
+        _init_worker(instances)
+        for work_unit in work_units:
+            yield work_unit, _solve_work_unit(work_unit, verify)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(instances,)) as executor:
+        futures = {executor.submit(_solve_work_unit, work_unit, verify): work_unit for work_unit in work_units}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
@@ -0,0 +1,241 @@
+import time
+
+from collections import defaultdict
+from src.bounded_allocation_solver import AllocationRecord, BoundedAllocationSolver
+from src.utils import ROUND, UNIT
+
+
+# Fixed-point version of the solver: the prices, budgets, spent amounts and item fractions are
+# integers counted in units, so no rounding is needed and the comparisons with the level bounds
+# and eta are exact. The divisions (and the level and eta limits of the buyers) round down, which
+# keeps every buyer within its budget and every item within its fraction. The objective values
+# agree with the float solver within a relative error of 10^-8, and of 10^-4 in the stepped mode,
+# where a difference of a few units can change the number of steps.
+class FixedPointAllocationSolver(BoundedAllocationSolver):
+    def __init__(self, data, verbose, stepped=False, verify=False, instrument=False):
+        super().__init__(data, verbose, stepped, verify, instrument)
+        self.budget_units = [round(x * UNIT) for x in self.budgets]
+        self.allocation_step_units = round(self.allocation_step * UNIT)
+        self.eta_units = 0
+        self.item_price = 0
+
+
+    def _init_solver(self):
+        super()._init_solver()
+        self.spent = [0 for _ in self.budgets]
+        self.eta_units = round(self.eta * UNIT)
+        self.objective_units = 0
+
+
+    def _get_state(self):
+        return super()._get_state(), self.objective_units
+
+
+    def _set_state(self, state):
+        super()._set_state(state[0])
+        self.objective_units = state[1]
+
+
+    def _spend(self, buyer_id, amount):
+        self.spent[buyer_id] += amount
+
+
+    def _has_spent(self, buyer_id, numerator, denominator):
+        # Whether the buyer spent numerator / denominator of its budget, rounded down to units,
+        # the same limit as the one of the available budget
+        return self.spent[buyer_id] >= self.budget_units[buyer_id] * numerator // denominator
+
+
+    def _update_buyer_level(self, buyer_id):
+        # The exact level is a lower bound, the rounded down limit of the next level may be reached too
+        level = min(self.spent[buyer_id] * self.bound // self.budget_units[buyer_id], self.bound)
+        if level < self.bound and self._has_spent(buyer_id, level + 1, self.bound):
+            level += 1
+        self.buyer_levels[buyer_id] = level
+
+
+    def _allocate_for_one_buyer(self, item, remaining_fraction):
+        if remaining_fraction <= 0:
+            return 0
+
+        if item.prediction is None:
+            return self.eta_units
+
+        if self._has_spent(item.prediction, 1, 1):
+            return remaining_fraction
+
+        prediction_fraction = UNIT - self.eta_units
+        new_fraction = remaining_fraction - prediction_fraction
+
+        if remaining_fraction < prediction_fraction:
+            prediction_fraction = remaining_fraction
+            new_fraction = 0
+
+        available_budget = self.budget_units[item.prediction] - self.spent[item.prediction]
+        price_fraction = self.item_price * prediction_fraction // UNIT
+
+        if price_fraction > available_budget:
+            prediction_fraction = available_budget * UNIT // self.item_price
+            price_fraction = available_budget
+            new_fraction = remaining_fraction - prediction_fraction
+
+        self.item_assignment[item.prediction] += prediction_fraction
+        self._spend(item.prediction, price_fraction)
+        self._update_buyer_level(item.prediction)
+
+        return new_fraction
+
+
+    def _get_available_budget(self, buyer_id, numerator, denominator):
+        # The amount the buyer can spend until it spent numerator / denominator of its budget
+        return self.budget_units[buyer_id] * numerator // denominator - self.spent[buyer_id]
+
+
+    def _allocate_on_level(self, item, remaining_fraction, level_idx, buyer_ids):
+        available_budgets = sorted((self._get_available_budget(buyer_id, level_idx + 1, self.bound), buyer_id) for buyer_id in buyer_ids)
+        num_buyers = len(available_budgets)
+
+        for idx, (available_budget, buyer_id) in enumerate(available_budgets):
+            if self.instrumentation is not None:
+                self.instrumentation.count('_allocate_on_level_rounds')
+
+            fraction_per_buyer = remaining_fraction // (num_buyers - idx)
+            price_fraction_per_buyer = self.item_price * fraction_per_buyer // UNIT
+
+            if price_fraction_per_buyer <= available_budget:
+                for _, other_buyer_id in available_budgets[idx:]:
+                    self.item_assignment[other_buyer_id] += fraction_per_buyer
+                    self._spend(other_buyer_id, price_fraction_per_buyer)
+                return 0
+
+            fraction = available_budget * UNIT // self.item_price
+            self.item_assignment[buyer_id] += fraction
+            self._spend(buyer_id, available_budget)
+            remaining_fraction -= fraction
+
+        return remaining_fraction
+
+
+    def _update_level_sets(self, level_idx, buyer_ids):
+        for buyer_id in buyer_ids:
+            if self._has_spent(buyer_id, level_idx + 1, self.bound):
+                self.buyer_levels[buyer_id] = level_idx + 1
+
+
+    def _needed_amount_to_reach_limit(self, buyer_ids):
+        return sum(max(self._get_available_budget(buyer_id, self.eta_units, UNIT), 0) for buyer_id in buyer_ids)
+
+
+    def _all_buyers_spent_enough(self, buyer_ids):
+        # As in the float solver, the budget fractions are compared with eta at the precision of a unit:
+        # spent / budget >= eta - 1 / (2 * UNIT), otherwise the rounded down equal shares miss eta by a
+        # few units and an extra step is taken
+        for buyer_id in buyer_ids:
+            if 2 * self.spent[buyer_id] * UNIT < (2 * self.eta_units - 1) * self.budget_units[buyer_id]:
+                return False
+        return True
+
+
+    def _allocate_to_reach_limit(self, item):
+        remaining_fraction = UNIT
+        limit_level = self.limit_level
+
+        level_idx, buyer_ids = self._get_buyers(item)
+        while remaining_fraction > 0 and level_idx != -1 and level_idx < limit_level:
+            remaining_fraction = self._allocate_on_level(item, remaining_fraction, level_idx, buyer_ids)
+            self._update_level_sets(level_idx, buyer_ids)
+            level_idx, buyer_ids = self._get_buyers(item)
+
+        if remaining_fraction > 0 and level_idx == limit_level and limit_level < self.bound:
+            needed_price = max(self._get_available_budget(buyer_id, self.eta_units, UNIT) for buyer_id in buyer_ids)
+            if needed_price > 0:
+                needed_amount = 0
+                for buyer_id in buyer_ids:
+                    needed_amount += min(needed_price, self._get_available_budget(buyer_id, level_idx + 1, self.bound))
+                needed_fraction = min(needed_amount * UNIT // self.item_price, remaining_fraction)
+
+                unallocated_fraction = self._allocate_on_level(item, needed_fraction, level_idx, buyer_ids)
+                self._update_level_sets(level_idx, buyer_ids)
+                remaining_fraction = remaining_fraction - needed_fraction + unallocated_fraction
+
+        return UNIT - remaining_fraction
+
+
+    def _allocate_to_reach_limit_stepped(self, item):
+        amount = self._needed_amount_to_reach_limit(item.interested_buyers)
+        fraction = UNIT
+
+        if amount >= self.item_price:
+            self._allocate_equally(item, fraction)
+        else:
+            fraction = amount * UNIT // self.item_price
+            self._allocate_equally(item, fraction)
+
+            max_steps = (UNIT - fraction) // self.allocation_step_units
+            for _ in range(max_steps):
+                if self._all_buyers_spent_enough(item.interested_buyers):
+                    break
+                self._allocate_equally(item, self.allocation_step_units)
+                fraction += self.allocation_step_units
+
+        return fraction
+
+
+    def _allocate_item(self, item):
+        self.item_assignment = defaultdict(lambda: 0)
+        self.item_price = round(item.price * UNIT)
+
+        if item.prediction is None:
+            self._allocate_equally(item, self.eta_units)
+        else:
+            if self.stepped:
+                fraction = self._allocate_to_reach_limit_stepped(item)
+            else:
+                fraction = self._allocate_to_reach_limit(item)
+
+            remaining_fraction = self._allocate_for_one_buyer(item, UNIT - fraction)
+            self._allocate_equally(item, remaining_fraction)
+
+        if self.verifier is not None:
+            self.verifier.check_item(item.id, self.item_assignment, UNIT)
+        return self.item_assignment
+
+
+    def _get_fractions(self, item_assignment):
+        return {buyer_id: fraction / UNIT for buyer_id, fraction in item_assignment.items()}
+
+
+    def solve(self, eta, predictions=None):
+        self._start_solve(eta)
+        self._init_items()
+        predictions = self.data.predictions if predictions is None else predictions
+        start = self._resume(predictions)
+
+        for item in self._get_items(predictions, start):
+            self._save_checkpoint(item.id)
+            item_assignment = self._allocate_item(item)
+            for buyer_id, fraction in item_assignment.items():
+                self.assignment[buyer_id][item.id] = fraction / UNIT
+                self.objective_units += self.item_price * fraction
+
+        self.objective_value = ROUND(self.objective_units / UNIT ** 2)
+        if self.verifier is not None:
+            self.verifier.check_spent(self.spent, UNIT)
+        return self.objective_value
+
+
+    def solve_stream(self, eta, items):
+        self._start_solve(eta)
+        self._init_solver()
+        objective_units = 0
+
+        for item in items:
+            start = time.perf_counter()
+            item_assignment = self._allocate_item(item)
+            allocation = self._get_fractions(item_assignment)
+            objective_units += self.item_price * sum(item_assignment.values())
+            self.objective_value = ROUND(objective_units / UNIT ** 2)
+            yield AllocationRecord(item.id, allocation, self.objective_value, time.perf_counter() - start)
+
+        if self.verifier is not None:
+            self.verifier.check_spent(self.spent, UNIT)
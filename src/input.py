@@ -1,4 +1,10 @@
-from src.utils import ROUND
+import hashlib
+import numpy as np
+
+from src.utils import FLOAT_PRECISION_DIGITS, ROUND
+
+# Marks the items in the predictions array which are predicted to not be sold
+NO_PREDICTION = -1
 
 
 class Buyer:
@@ -6,25 +12,12 @@ class Buyer:
         self.id = buyer_id
         self.budget = budget
 
-        self.spent = 0.0
-        self.budget_fraction = 0.0
-
         self.wanted_item_ids = []
         self.potential_expense = 0
 
 
     def __repr__(self):
-        return f'Buyer\t[{self.id}]:\tbudget = {self.budget},\t\tbudget_fraction = {self.budget_fraction},   \twanted_items = {self.wanted_item_ids}'
-
-
-    def reset(self):
-        self.spent = 0
-        self.budget_fraction = 0.0
-
-
-    def spend(self, amount):
-        self.spent = ROUND(self.spent + amount)
-        self.budget_fraction = ROUND(self.spent / self.budget)
+        return f'Buyer\t[{self.id}]:\tbudget = {self.budget},   \twanted_items = {self.wanted_item_ids}'
 
 
 
@@ -41,6 +34,87 @@ class Item:
 
 
 
+class BuyerView:
+    def __init__(self, data, buyer_id):
+        self.data = data
+        self.id = buyer_id
+
+
+    @property
+    def budget(self):
+        return self.data.budgets[self.id].item()
+
+
+    @property
+    def wanted_item_ids(self):
+        return self.data.get_wanted_item_ids(self.id)
+
+
+    @property
+    def potential_expense(self):
+        return self.data.potential_expenses[self.id].item()
+
+
+    def __repr__(self):
+        return f'Buyer\t[{self.id}]:\tbudget = {self.budget},   \twanted_items = {self.wanted_item_ids}'
+
+
+
+class ItemView:
+    def __init__(self, data, item_id):
+        self.data = data
+        self.id = item_id
+
+
+    @property
+    def price(self):
+        return self.data.prices[self.id].item()
+
+
+    @property
+    def interested_buyers(self):
+        return self.data.get_interested_buyers(self.id)
+
+
+    @property
+    def prediction(self):
+        prediction = self.data.predictions[self.id].item()
+        return None if prediction == NO_PREDICTION else prediction
+
+
+    @prediction.setter
+    def prediction(self, buyer_id):
+        self.data.predictions[self.id] = NO_PREDICTION if buyer_id is None else buyer_id
+
+
+    def __repr__(self):
+        return f'Item\t[{self.id}]:\tprice = {self.price},\t\tprediction = {self.prediction},   \t\tinterested_buyers = {self.interested_buyers}'
+
+
+
+class ViewList:
+    def __init__(self, data, view_class, length):
+        self.data = data
+        self.view_class = view_class
+        self.length = length
+
+
+    def __len__(self):
+        return self.length
+
+
+    def __getitem__(self, idx):
+        if idx < 0 or idx >= self.length:
+            raise IndexError(f'{self.view_class.__name__} index [{idx}] out of range!')
+        return self.view_class(self.data, idx)
+
+
+    def __iter__(self):
+        for idx in range(self.length):
+            yield self.view_class(self.data, idx)
+
+
+
 class ProblemInput:
     def __init__(self, configuration):
         self.config = configuration
@@ -52,6 +126,30 @@ class ProblemInput:
         self.metrics = {}
 
 
+    def compact(self):
+        item_ptr = [0]
+        item_buyers = []
+        for item in self.items:
+            item_buyers.extend(item.interested_buyers)
+            item_ptr.append(len(item_buyers))
+
+        budgets = [x.budget for x in self.buyers]
+        prices = [x.price for x in self.items]
+        compact_input = CompactProblemInput(self.config, budgets, prices, item_ptr, item_buyers)
+        for item in self.items:
+            compact_input.items[item.id].prediction = item.prediction
+        return compact_input
+
+
+    def _get_observations(self):
+        budget_list = [x.budget for x in self.buyers]
+        price_list = [x.price for x in self.items]
+        buyers_list = [len(x.interested_buyers) for x in self.items]
+        items_list = [len(x.wanted_item_ids) for x in self.buyers]
+        expense_list = [x.potential_expense for x in self.buyers]
+        return budget_list, price_list, buyers_list, items_list, expense_list
+
+
     def _get_metric_string(self, display_name, value_list, all):
         name = display_name.split(':')[0]
         self.metrics[name] = {}
@@ -66,22 +164,123 @@ class ProblemInput:
         output = self.config.__str__()
         output += '\n\nObservations of the input:\n'
 
-        budget_list = [x.budget for x in self.buyers]
+        budget_list, price_list, buyers_list, items_list, expense_list = self._get_observations()
         output += self._get_metric_string('Budget:\t', budget_list, self.config.num_buyers)
-
-        price_list = [x.price for x in self.items]
         output += self._get_metric_string('Price:\t', price_list, self.config.num_items)
-
-        buyers_list = [len(x.interested_buyers) for x in self.items]
         output += self._get_metric_string('NumBuyers:', buyers_list, self.config.num_items)
-
-        items_list = [len(x.wanted_item_ids) for x in self.buyers]
         output += self._get_metric_string('NumItems:', items_list, self.config.num_buyers)
-
-        expense_list = [x.potential_expense for x in self.buyers]
         output += self._get_metric_string('Expenses:', expense_list, self.config.num_buyers)
 
-        overflow = sum([x.potential_expense > x.budget for x in self.buyers])
+        overflow = sum([expense > budget for expense, budget in zip(expense_list, budget_list)])
         percentage = ROUND((overflow / self.config.num_buyers) * 100)
         output += f'{int(percentage)} % number of buyers want to spend more, than their budget.\n'
         return output
+
+
+
+# Array representation of the input: budget and price arrays, the buyer-item incidence in CSR
+# form (interested buyers per item) and in CSC form (wanted items per buyer). The buyers and
+# items lists hold thin views, which are created on access.
+class CompactProblemInput(ProblemInput):
+    def __init__(self, configuration, budgets, prices, item_ptr, item_buyers):
+        super().__init__(configuration)
+        self.budgets = np.asarray(budgets)
+        self.prices = np.asarray(prices, dtype=float)
+        num_buyers = len(self.budgets)
+        num_items = len(self.prices)
+
+        self.buyer_ids = range(num_buyers)
+        self.item_ids = range(num_items)
+        self.predictions = np.full(num_items, NO_PREDICTION, dtype=np.int64)
+
+        # The interested buyers of item j are item_buyers[item_ptr[j]:item_ptr[j + 1]]
+        self.item_ptr = np.asarray(item_ptr, dtype=np.int64)
+        self.item_buyers = np.asarray(item_buyers, dtype=np.int64)
+
+        # The item of each incidence entry, the entries in CSR order form a COO matrix with item_buyers
+        self.entry_items = np.repeat(np.arange(num_items), np.diff(self.item_ptr))
+
+        # The wanted items of buyer i are buyer_items[buyer_ptr[i]:buyer_ptr[i + 1]], in increasing order,
+        # buyer_entries holds the CSR entry of each of them (the narrowest type lets NumPy use radix sort)
+        self.buyer_entries = np.argsort(self.item_buyers.astype(np.min_scalar_type(max(num_buyers - 1, 0))), kind='stable')
+        self.buyer_items = self.entry_items[self.buyer_entries]
+        self.buyer_ptr = np.zeros(num_buyers + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.item_buyers, minlength=num_buyers), out=self.buyer_ptr[1:])
+
+        expenses = np.bincount(self.item_buyers, weights=self.prices[self.entry_items], minlength=num_buyers)
+        self.potential_expenses = np.round(expenses, FLOAT_PRECISION_DIGITS)
+
+        self.buyers = ViewList(self, BuyerView, num_buyers)
+        self.items = ViewList(self, ItemView, num_items)
+
+
+    def compact(self):
+        return self
+
+
+    def get_hash(self):
+        # Identifies the instance by its content, the bound and the predictions are not included
+        content = hashlib.sha256()
+        for array in (self.budgets.astype(np.float64), self.prices, self.item_ptr, self.item_buyers):
+            content.update(np.ascontiguousarray(array).tobytes())
+        return content.hexdigest()[:32]
+
+
+    def get_components(self):
+        # The connected components of the buyer-item graph: the component id of each buyer (numbered in the
+        # order of their smallest buyer id) and the number of components. Every buyer starts with its own id
+        # as label and takes the smallest label of the items it wants, the pointer jumping shortens the chains.
+        num_buyers = len(self.budgets)
+        labels = np.arange(num_buyers)
+        while True:
+            item_labels = np.full(len(self.prices), num_buyers)
+            np.minimum.at(item_labels, self.entry_items, labels[self.item_buyers])
+            new_labels = labels.copy()
+            np.minimum.at(new_labels, self.item_buyers, item_labels[self.entry_items])
+            while True:
+                jumped_labels = new_labels[new_labels]
+                if np.array_equal(jumped_labels, new_labels):
+                    break
+                new_labels = jumped_labels
+            if np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+
+        roots, components = np.unique(labels, return_inverse=True)
+        return components, len(roots)
+
+
+    def get_interested_buyers(self, item_id):
+        return self.item_buyers[self.item_ptr[item_id]:self.item_ptr[item_id + 1]].tolist()
+
+
+    def get_wanted_item_ids(self, buyer_id):
+        return self.buyer_items[self.buyer_ptr[buyer_id]:self.buyer_ptr[buyer_id + 1]].tolist()
+
+
+    def _get_observations(self):
+        buyers_list = np.diff(self.item_ptr)
+        items_list = np.diff(self.buyer_ptr)
+        return self.budgets, self.prices, buyers_list, items_list, self.potential_expenses
+
+
+
+def write_item_stream(data, stream_file):
+    with open(stream_file, 'w+') as out_file:
+        out_file.write('ID;Price;InterestedBuyers;Prediction\n')
+        for item in data.items:
+            buyer_ids = ','.join(str(x) for x in item.interested_buyers)
+            prediction = '' if item.prediction is None else item.prediction
+            out_file.write(f'{item.id};{item.price};{buyer_ids};{prediction}\n')
+
+
+def read_item_stream(stream_file):
+    # Yields the items one by one, so the stream does not need to fit in memory
+    with open(stream_file, 'r') as in_file:
+        next(in_file)
+        for line in in_file:
+            item_id, price, buyer_ids, prediction = line.rstrip('\n').split(';')
+            item = Item(int(item_id), float(price), [int(x) for x in buyer_ids.split(',') if x != ''])
+            if prediction != '':
+                item.prediction = int(prediction)
+            yield item
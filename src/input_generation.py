@@ -1,42 +1,76 @@
-import random
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from src.input import CompactProblemInput
+from src.utils import FLOAT_PRECISION_DIGITS
+
+# Number of items drawn from one random sub-stream
+BLOCK_SIZE = 2 ** 16
+
+# Version of the generated instances, part of the key of the stored instances. It changes whenever the generator draws
+# different instances from the same configuration (version 2: the items are drawn in blocks from sub-streams).
+GENERATOR_VERSION = 2
 
-from src.utils import ROUND
-from src.input import Buyer, Item, ProblemInput
 
 class InputGenerator:
     def __init__(self, configuration):
         self.config = configuration
-        self.data = ProblemInput(configuration)
+        self.num_blocks = -(-self.config.num_items // BLOCK_SIZE)
+
+
+    def _get_rng(self, stream_idx):
+        # Stream 0 draws the budgets and stream k + 1 the items of block k, every stream is
+        # derived from the seed alone, so the blocks can be generated in any order or in parallel
+        seed_sequence = np.random.SeedSequence(self.config.random_seed, spawn_key=(stream_idx,))
+        return np.random.Generator(np.random.PCG64(seed_sequence))
+
+
+    def _get_budgets(self):
+        rng = self._get_rng(0)
+        return rng.integers(self.config.min_budget, self.config.max_budget + 1, size=self.config.num_buyers)
 
 
-    def _get_budget(self):
-        return random.randint(self.config.min_budget, self.config.max_budget)
+    def _get_buyer_ids(self, rng, num_buyers):
+        # Floyd's sampling for every item at once: step s draws from [0, num_buyers - n + s]
+        # and takes the upper end instead if the drawn buyer is already chosen
+        num_items = len(num_buyers)
+        buyer_ids = np.full((num_items, self.config.max_buyers), -1, dtype=np.int64)
+        for step in range(self.config.max_buyers):
+            upper = self.config.num_buyers - num_buyers + step
+            drawn = rng.integers(0, upper + 1)
+            chosen = (buyer_ids[:, :step] == drawn[:, None]).any(axis=1)
+            buyer_ids[:, step] = np.where(step < num_buyers, np.where(chosen, upper, drawn), -1)
 
+        buyer_ids.sort(axis=1)
+        return buyer_ids[buyer_ids >= 0]
 
-    def _get_price(self):
-        ratio = random.random()
-        price = ROUND(self.config.max_price * ratio)
-        price = max(price, self.config.min_price)
-        return price
 
+    def _get_prices(self, rng, num_items):
+        ratios = rng.random(num_items)
+        prices = np.round(self.config.max_price * ratios, FLOAT_PRECISION_DIGITS)
+        return np.maximum(prices, self.config.min_price)
 
-    def _get_buyer_ids(self):
-        num_buyers = random.randint(self.config.min_buyers, self.config.max_buyers)
-        return random.sample(self.data.buyer_ids, num_buyers)
 
+    def _generate_block(self, block_idx):
+        rng = self._get_rng(block_idx + 1)
+        num_items = min(BLOCK_SIZE, self.config.num_items - block_idx * BLOCK_SIZE)
+        num_buyers = rng.integers(self.config.min_buyers, self.config.max_buyers + 1, size=num_items)
+        item_buyers = self._get_buyer_ids(rng, num_buyers)
+        prices = self._get_prices(rng, num_items)
+        return prices, num_buyers, item_buyers
 
-    def generate(self):
-        random.seed(self.config.random_seed)
 
-        for idx in self.data.buyer_ids:
-            self.data.buyers.append(Buyer(idx, self._get_budget()))
+    def generate(self, jobs=1):
+        if jobs == 1:
+            blocks = [self._generate_block(block_idx) for block_idx in range(self.num_blocks)]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                blocks = list(executor.map(self._generate_block, range(self.num_blocks)))
 
-        for idx in range(self.config.num_items):
-            buyer_ids = self._get_buyer_ids()
-            price = self._get_price()
-            self.data.items.append(Item(idx, price, buyer_ids))
-            for buyer_id in buyer_ids:
-                self.data.buyers[buyer_id].wanted_item_ids.append(idx)
-                self.data.buyers[buyer_id].potential_expense = ROUND(self.data.buyers[buyer_id].potential_expense + price)
+        prices = np.concatenate([x[0] for x in blocks])
+        item_ptr = np.zeros(self.config.num_items + 1, dtype=np.int64)
+        np.cumsum(np.concatenate([x[1] for x in blocks]), out=item_ptr[1:])
+        item_buyers = np.concatenate([x[2] for x in blocks])
 
-        return self.data
+        return CompactProblemInput(self.config, self._get_budgets(), prices, item_ptr, item_buyers)
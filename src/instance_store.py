@@ -0,0 +1,50 @@
+import hashlib
+import numpy as np
+
+from dataclasses import astuple
+
+from src.cache import ArrayCache
+from src.input import CompactProblemInput
+from src.input_generation import GENERATOR_VERSION, InputGenerator
+
+
+def _get_instance(configuration, arrays):
+    return CompactProblemInput(configuration, arrays['budgets'], arrays['prices'], arrays['item_ptr'], arrays['item_buyers'])
+
+
+def load_instance(configuration, paths):
+    return _get_instance(configuration, {name: np.load(path, mmap_mode='r') for name, path in paths.items()})
+
+
+
+# The generated instances are written once to the cache directory, keyed by their configuration
+# (including the random seed) and the version of the generator, and later runs load them memory mapped. The worker processes
+# load them from their paths with load_instance, without writing to the store.
+class InstanceStore:
+    def __init__(self, cache_dir, size_limit, in_use=None):
+        self.cache = ArrayCache(cache_dir, 'instance', size_limit, in_use)
+
+
+    def _get_key(self, configuration):
+        return hashlib.sha256(repr((GENERATOR_VERSION, astuple(configuration))).encode()).hexdigest()[:32]
+
+
+    def get(self, configuration, jobs=1):
+        key = self._get_key(configuration)
+        arrays = self.cache.load(key)
+        if arrays is not None:
+            return _get_instance(configuration, arrays)
+
+        data = InputGenerator(configuration).generate(jobs)
+        self.cache.save(key, {
+            'budgets': data.budgets,
+            'prices': data.prices,
+            'item_ptr': data.item_ptr,
+            'item_buyers': data.item_buyers
+        })
+        return data
+
+
+    def get_paths(self, configuration):
+        # The paths of the arrays of a stored instance, which stays in the store until the end of the run
+        return self.cache.get_paths(self._get_key(configuration))
@@ -0,0 +1,53 @@
+import time
+
+from collections import defaultdict
+
+
+# Counts the calls of methods and measures the time spent in them (including the nested calls).
+# The methods are wrapped on the instance only when instrumentation is asked for, so disabled
+# instrumentation costs nothing.
+class Instrumentation:
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        self.calls = defaultdict(int)
+        self.times = defaultdict(float)
+        # The duration of every call of the methods wrapped with record_durations
+        self.durations = defaultdict(list)
+
+
+    def wrap(self, name, function, record_durations=False):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            duration = time.perf_counter() - start
+            self.calls[name] += 1
+            self.times[name] += duration
+            if record_durations:
+                self.durations[name].append(duration)
+            return result
+        return wrapper
+
+
+    def count(self, name):
+        # Counts an event inside a method (for example a loop iteration), without timing it
+        self.calls[name] += 1
+
+
+    def instrument(self, obj, names, recorded_names=()):
+        for name in names:
+            setattr(obj, name, self.wrap(name, getattr(obj, name), name in recorded_names))
+
+
+    def get_counters(self):
+        counters = {}
+        for name in self.calls:
+            counters[name] = {'calls': self.calls[name], 'time': self.times[name]}
+            if name in self.durations:
+                durations = sorted(self.durations[name])
+                counters[name]['mean_time'] = self.times[name] / len(durations)
+                counters[name]['max_time'] = durations[-1]
+                counters[name]['p99_time'] = durations[int(0.99 * (len(durations) - 1))]
+        return counters
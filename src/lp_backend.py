@@ -0,0 +1,157 @@
+import highspy
+import numpy as np
+import pulp
+
+from dataclasses import dataclass
+
+from src.utils import FLOAT_PRECISION_DIGITS
+
+# The in-process backend, every other solver name is a PuLP solver (PuLP's own HiGHS solver is named 'HiGHS')
+HIGHS = 'HIGHS'
+# The model statuses of HiGHS as PuLP statuses, the others are undefined
+HIGHS_STATUSES = {
+    highspy.HighsModelStatus.kOptimal: pulp.LpStatusOptimal,
+    highspy.HighsModelStatus.kInfeasible: pulp.LpStatusInfeasible,
+    highspy.HighsModelStatus.kUnbounded: pulp.LpStatusUnbounded,
+    highspy.HighsModelStatus.kUnboundedOrInfeasible: pulp.LpStatusUnbounded,
+    highspy.HighsModelStatus.kTimeLimit: pulp.LpStatusNotSolved,
+    highspy.HighsModelStatus.kIterationLimit: pulp.LpStatusNotSolved
+}
+
+
+# The LP of the offline problem: maximize the sum of var_prices[k] * y[k] subject to the budget of every buyer
+# and to at most one unit of every item, with y >= 0 (and binary y in the integral problem). The variables
+# follow the CSC order, the variables of buyer i are buyer_ptr[i]:buyer_ptr[i + 1] and the variables of item j
+# are item_vars[item_ptr[j]:item_ptr[j + 1]].
+@dataclass
+class LinearProgram:
+    budgets: list
+    buyer_ptr: list
+    var_buyers: list
+    var_items: list
+    var_prices: list
+    item_ptr: list
+    item_vars: list
+
+
+
+# Builds the LP as a PuLP model and solves it with an external PuLP solver, through model and solution files.
+# The integral problem is the same model with binary variables, warm started from a fractional solution if
+# asked (the warm start slows down some solvers, CBC takes 45 s instead of 1 s on config 2).
+class PulpBackend:
+    def __init__(self, solver_name, print_solver_messages, warm_start):
+        self.solver_name = solver_name
+        self.print_solver_messages = print_solver_messages
+        self.warm_start = warm_start
+        self.model = None
+        self.vars = []
+
+
+    def build(self, program):
+        self.model = pulp.LpProblem(name='max-profit-bounded-allocation', sense=pulp.LpMaximize)
+
+        # Define the variables, the model starts as the fractional relaxation
+        self.vars = [pulp.LpVariable(name=f"y{i}_{j}", cat=pulp.LpContinuous, lowBound=0) for i, j in zip(program.var_buyers, program.var_items)]
+
+        # Objective value
+        self.model += pulp.LpAffineExpression(zip(self.vars, program.var_prices))
+
+        # Constraints
+        for i, budget in enumerate(program.budgets):
+            start, end = program.buyer_ptr[i], program.buyer_ptr[i + 1]
+            budget_expression = pulp.LpAffineExpression(zip(self.vars[start:end], program.var_prices[start:end]))
+            self.model += pulp.LpConstraint(budget_expression, pulp.LpConstraintLE, f"budget_{i}", budget)
+        for j in range(len(program.item_ptr) - 1):
+            fraction_expression = pulp.LpAffineExpression((self.vars[k], 1) for k in program.item_vars[program.item_ptr[j]:program.item_ptr[j + 1]])
+            self.model += pulp.LpConstraint(fraction_expression, pulp.LpConstraintLE, f"item_fraction_{j}", 1)
+
+
+    def _set_integral(self, start_values):
+        # The items fully sold in the fractional solution give a feasible integral starting solution
+        for var, value in zip(self.vars, start_values):
+            var.cat = pulp.LpInteger
+            var.upBound = 1
+            if self.warm_start:
+                var.setInitialValue(1 if value >= 1 - 10 ** -FLOAT_PRECISION_DIGITS else 0)
+
+
+    def solve(self, integral, start_values=None):
+        # Returns the status, the objective value and the values of the variables
+        if integral:
+            self._set_integral(start_values)
+        self.model.solve(pulp.getSolver(self.solver_name, msg=self.print_solver_messages, warmStart=integral and self.warm_start))
+        return self.model.status, self.model.objective.value(), [var.varValue for var in self.vars]
+
+
+
+# Solves the LP with HiGHS in the process through highspy: the sparse column-wise matrix is passed from the
+# arrays and the primal values are returned as an array, without files and external processes. The relaxation
+# is solved by the interior point method (with crossover to a vertex), which is much faster than the simplex
+# method on the large instances. The integral problem is the same model with binary variables, warm started
+# from the items fully sold in a fractional solution if asked.
+class HighsBackend:
+    def __init__(self, print_solver_messages, warm_start):
+        self.warm_start = warm_start
+        self.highs = highspy.Highs()
+        self.highs.setOptionValue('output_flag', bool(print_solver_messages))
+        self.num_vars = 0
+        self.prices = None
+
+
+    def build(self, program):
+        # Every variable has a coefficient in the budget row of its buyer (its price) and in the row of its item (one)
+        self.num_vars = len(program.var_prices)
+        num_buyers = len(program.budgets)
+        num_items = len(program.item_ptr) - 1
+        self.prices = np.asarray(program.var_prices, dtype=float)
+
+        model = highspy.HighsLp()
+        model.num_col_ = self.num_vars
+        model.num_row_ = num_buyers + num_items
+        model.sense_ = highspy.ObjSense.kMaximize
+        model.col_cost_ = self.prices
+        model.col_lower_ = np.zeros(self.num_vars)
+        model.col_upper_ = np.full(self.num_vars, highspy.kHighsInf)
+        model.row_lower_ = np.full(num_buyers + num_items, -highspy.kHighsInf)
+        model.row_upper_ = np.concatenate((np.asarray(program.budgets, dtype=float), np.ones(num_items)))
+        model.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+        model.a_matrix_.start_ = np.arange(0, 2 * self.num_vars + 1, 2)
+        model.a_matrix_.index_ = np.column_stack((program.var_buyers, num_buyers + np.asarray(program.var_items, dtype=np.int64))).ravel()
+        model.a_matrix_.value_ = np.column_stack((self.prices, np.ones(self.num_vars))).ravel()
+        self.highs.passModel(model)
+
+
+    def _set_integral(self, start_values):
+        variables = np.arange(self.num_vars, dtype=np.int32)
+        self.highs.changeColsIntegrality(self.num_vars, variables, np.full(self.num_vars, highspy.HighsVarType.kInteger))
+        self.highs.changeColsBounds(self.num_vars, variables, np.zeros(self.num_vars), np.ones(self.num_vars))
+        if self.warm_start:
+            solution = highspy.HighsSolution()
+            solution.col_value = (np.asarray(start_values) >= 1 - 10 ** -FLOAT_PRECISION_DIGITS).astype(float).tolist()
+            self.highs.setSolution(solution)
+
+
+    def solve(self, integral, start_values=None):
+        # Returns the status, the objective value and the values of the variables
+        if integral:
+            self._set_integral(start_values)
+        self.highs.setOptionValue('solver', 'choose' if integral else 'ipm')
+        self.highs.run()
+
+        values = np.array(self.highs.getSolution().col_value)
+        if len(values) != self.num_vars:
+            values = np.zeros(self.num_vars)
+        values = np.round(values) if integral else np.round(values, FLOAT_PRECISION_DIGITS)
+        status = HIGHS_STATUSES.get(self.highs.getModelStatus(), pulp.LpStatusUndefined)
+        return status, float(self.prices @ values), values.tolist()
+
+
+
+def get_backend(solver_name, print_solver_messages, warm_start=True):
+    if solver_name == HIGHS:
+        return HighsBackend(print_solver_messages, warm_start)
+    return PulpBackend(solver_name, print_solver_messages, warm_start)
+
+
+def get_available_solvers():
+    return [HIGHS] + pulp.listSolvers(onlyAvailable=True)
@@ -1,127 +1,274 @@
-import json
-import os
+import numpy as np
 import pulp
+import time
 
+from concurrent.futures import ProcessPoolExecutor
+
+from src.cache import get_lp_cache_key
+from src.input import CompactProblemInput
+from src.lp_backend import HIGHS, LinearProgram, get_available_solvers, get_backend
+from src.max_flow import MaxFlowSolver
+from src.rounding import RoundingSolver
 from src.utils import ROUND
 
+# The connected components with fewer variables are solved together in parts of at least this
+# many variables, so the small components do not cost a solver call each
+MIN_PART_SIZE = 1000
+
+
+def _solve_part(part):
+    data, verbose, integral, solver_name, warm_start, max_flow, gap_budget, deadline = part
+    lp_solver = LPSolverWrapper(data, None, verbose, integral, solver_name, warm_start=warm_start, max_flow=max_flow, gap_budget=gap_budget, deadline=deadline)
+    lp_solver.solve()
+    return lp_solver.status, lp_solver.fractional_objective_value, lp_solver.fractional_values, lp_solver.integral_objective_value, lp_solver.integral_values
+
+
+
 class LPSolverWrapper:
-    def __init__(self, data, cache_file, verbose):
-        self.buyers = data.buyers
+    def __init__(self, data, cache, verbose, integral=True, solver_name=HIGHS, warm_start=True, jobs=1, max_flow=False, gap_budget=None, time_limit=None, deadline=None):
+        data = data.compact()
+        self.data = data
         self.buyer_ids = data.buyer_ids
-
-        self.items = data.items
         self.item_ids = data.item_ids
 
-        self.budgets = [x.budget for x in data.buyers]
-        self.prices = [x.price for x in data.items]
+        self.budgets = data.budgets.tolist()
+        self.prices = data.prices.tolist()
+
+        # Sparse coefficient arrays, the variables follow the CSC order (by buyer, then by item)
+        self.buyer_ptr = data.buyer_ptr.tolist()
+        self.var_buyers = np.repeat(np.arange(len(self.budgets)), np.diff(data.buyer_ptr)).tolist()
+        self.var_items = data.buyer_items.tolist()
+        self.var_prices = data.prices[data.buyer_items].tolist()
+
+        # The variables of item j are item_vars[item_ptr[j]:item_ptr[j + 1]]
+        self.item_ptr = data.item_ptr.tolist()
+        self.item_vars = np.empty_like(data.buyer_entries)
+        self.item_vars[data.buyer_entries] = np.arange(len(data.buyer_entries))
+        self.item_vars = self.item_vars.tolist()
 
-        self.cache_file = cache_file
+        # The solutions are cached as values in the variable order
+        self.cache = cache
+        self.cache_key = get_lp_cache_key(data.get_hash(), gap_budget)
         self.verbose = verbose
+        self.integral = integral
+        self.solver_name = solver_name
+        self.jobs = jobs
+        self.max_flow = max_flow
+        self.gap_budget = gap_budget
+        # The local search of the heuristic stops after the time limit (in seconds) or at the deadline (a time.time()
+        # value), the parts of a fragmented instance share one deadline
+        self.time_limit = time_limit
+        self.deadline = deadline
         self.print_solver_messages = (self.verbose == 2)
 
-        self.model = None
-        self.vars = []
+        self.program = LinearProgram(self.budgets, self.buyer_ptr, self.var_buyers, self.var_items, self.var_prices, self.item_ptr, self.item_vars)
+        self.warm_start = warm_start
+        self.backend = get_backend(solver_name, self.print_solver_messages, warm_start)
         self.status = None
 
-        self.integral_objective_value = 0
-        self.integral_solution = []
+        self.integral_objective_value = None
+        self.integral_solution = None
         self.fractional_objective_value = 0
         self.fractional_solution = []
+        self.fractional_values = []
+        self.integral_values = []
 
 
     def _load_data_from_cache(self):
-        print('Load LP data from cache file.')
-        with open(self.cache_file, 'r') as in_file:
-            data = json.load(in_file)
-            self.status = data['status']
-            self.integral_objective_value = data['integral_objective_value']
-            self.fractional_objective_value = data['fractional_objective_value']
+        arrays = self.cache.load(self.cache_key)
+        if arrays is None:
+            return
 
-            # The json format converts the integral keys to strings, so we convert it back
-            self.integral_solution = []
-            for dictionary in data['integral_solution']:
-                self.integral_solution.append({int(key): value for key, value in dictionary.items()})
-
-            self.fractional_solution = []
-            for dictionary in data['fractional_solution']:
-                self.fractional_solution.append({int(key): value for key, value in dictionary.items()})
+        print('Load LP data from cache.')
+        status, fractional_objective_value, integral_objective_value = arrays['summary'].tolist()
+        self.status = int(status)
+        self.fractional_objective_value = fractional_objective_value
+        self.fractional_solution = self._get_solution(arrays['fractional'].tolist())
+        if 'integral' in arrays:
+            self.integral_objective_value = integral_objective_value
+            self.integral_solution = self._get_solution(arrays['integral'].tolist())
 
 
     def _save_data_to_cache(self):
-        data = {
-            'status': self.status,
-            'integral_objective_value': self.integral_objective_value,
-            'integral_solution': self.integral_solution,
-            'fractional_objective_value': self.fractional_objective_value,
-            'fractional_solution': self.fractional_solution
+        integral_objective_value = np.nan if self.integral_solution is None else self.integral_objective_value
+        arrays = {
+            'summary': np.array([self.status, self.fractional_objective_value, integral_objective_value]),
+            'fractional': np.array(self.fractional_values)
         }
-        with open(self.cache_file, 'w+') as out_file:
-            json.dump(data, out_file, indent=4)
+        if self.integral_solution is not None:
+            arrays['integral'] = np.array(self.integral_values)
+        self.cache.save(self.cache_key, arrays)
 
 
-    def _init_model(self, category):
-        # Define the variables
-        self.vars = []
+    def _get_solution(self, values):
+        solution = []
         for i in self.buyer_ids:
-            buyer_variables = {}
-            for j in self.buyers[i].wanted_item_ids:
-                buyer_variables[j] = pulp.LpVariable(name=f"y{i}_{j}", cat=category, lowBound=0)
-            self.vars.append(buyer_variables)
+            start, end = self.buyer_ptr[i], self.buyer_ptr[i + 1]
+            solution.append(dict(zip(self.var_items[start:end], values[start:end])))
+        return solution
 
-        # Objective value
-        weighted_vars = []
-        for i in self.buyer_ids:
-            for j in self.buyers[i].wanted_item_ids:
-                weighted_vars.append(self.prices[j] * self.vars[i][j])
-        self.model += pulp.lpSum(weighted_vars)
 
-        # Constraints
-        for i in self.buyer_ids:
-            self.model += (pulp.lpSum(self.prices[j] * self.vars[i][j] for j in self.buyers[i].wanted_item_ids) <= self.budgets[i], f"budget_{i}")
-        for j in self.item_ids:
-            self.model += (pulp.lpSum(self.vars[i][j] for i in self.items[j].interested_buyers) <= 1, f"item_fraction_{j}")
+    def build_model(self):
+        self.backend.build(self.program)
 
 
-    def _get_solution(self):
-        solution = []
-        for i in self.buyer_ids:
-            buyer_variables = {}
-            for j in self.buyers[i].wanted_item_ids:
-                buyer_variables[j] = self.vars[i][j].varValue
-            solution.append(buyer_variables)
-        return solution
+    def _solve_max_flow(self):
+        # The relaxation is a maximum flow problem, its optimum is solved without an external solver
+        max_flow_solver = MaxFlowSolver(self.data)
+        self.status = pulp.LpStatusOptimal
+        self.fractional_objective_value = max_flow_solver.solve()
+        self.fractional_values = max_flow_solver.get_fractions()[self.data.buyer_entries].tolist()
+
+
+    def _solve_heuristic(self):
+        # The rounded fractional solution, improved by local search, is accepted if its gap to the relaxation (an upper
+        # bound on the gap to the integral optimum) is within the budget. Returns whether it is accepted.
+        fractions = np.empty(len(self.fractional_values))
+        fractions[self.data.buyer_entries] = self.fractional_values
+        if self.deadline is None and self.time_limit is not None:
+            self.deadline = time.time() + self.time_limit
+        rounding_solver = RoundingSolver(self.data, fractions, self.deadline)
+        self.integral_objective_value = rounding_solver.solve()
+        self.integral_values = rounding_solver.get_values()[self.data.buyer_entries].tolist()
+
+        gap = self._get_gap()
+        if self.verbose > 0:
+            print(f'Heuristic integral solution: gap <= {gap} %, budget = {self.gap_budget} %')
+        return gap <= self.gap_budget
+
+
+    def _check_solver(self):
+        # The availability of the LP solver is checked only when a model is solved, not for the cached solutions, the
+        # relaxation as a maximum flow nor the heuristic integral solution within the gap budget
+        if self.solver_name not in get_available_solvers():
+            raise ValueError(f'The LP solver [{self.solver_name}] is not available!')
+
+
+    def _solve_model(self):
+        if self.max_flow:
+            self._solve_max_flow()
+        else:
+            self._check_solver()
+            self.build_model()
+            self.status, objective_value, self.fractional_values = self.backend.solve(integral=False)
+            self.fractional_objective_value = ROUND(objective_value)
+
+        if not self.integral or (self.gap_budget is not None and self._solve_heuristic()):
+            return
+
+        # The same model is solved again with integral variables, warm started from the relaxation if the backend can
+        if self.max_flow:
+            self._check_solver()
+            self.build_model()
+        self.status, self.integral_objective_value, self.integral_values = self.backend.solve(integral=True, start_values=self.fractional_values)
+
+
+    def _get_parts(self):
+        # The part of each buyer, the connected components are packed in their order into parts of at least MIN_PART_SIZE variables
+        components, num_components = self.data.get_components()
+        sizes = np.bincount(components, weights=np.diff(self.data.buyer_ptr), minlength=num_components).tolist()
+        component_parts = []
+        num_parts = 0
+        part_size = 0
+        for size in sizes:
+            if part_size >= MIN_PART_SIZE:
+                num_parts += 1
+                part_size = 0
+            component_parts.append(num_parts)
+            part_size += size
+        return np.array(component_parts)[components], num_parts + 1
+
+
+    def _get_part_input(self, buyer_parts, part):
+        # The instance of the buyers of the part and of the items they want, both in their original order,
+        # so its variables are the variables of the part in the same order
+        data = self.data
+        buyers = np.flatnonzero(buyer_parts == part)
+        buyer_map = np.full(len(self.budgets), -1)
+        buyer_map[buyers] = np.arange(len(buyers))
+        entries = (buyer_parts[data.item_buyers] == part)
+        items = np.unique(data.entry_items[entries])
+        item_ptr = np.zeros(len(items) + 1, dtype=np.int64)
+        np.cumsum(np.diff(data.item_ptr)[items], out=item_ptr[1:])
+        return CompactProblemInput(data.config, data.budgets[buyers], data.prices[items], item_ptr, buyer_map[data.item_buyers[entries]])
+
+
+    def _solve_parts(self, buyer_parts, num_parts):
+        # The parts are independent LPs, they are solved in parallel (the largest first) and their solutions are stitched
+        # together, the parts without variables (buyers without wanted items) are skipped
+        var_parts = np.repeat(buyer_parts, np.diff(self.data.buyer_ptr))
+        part_sizes = np.bincount(var_parts, minlength=num_parts)
+        order = [part for part in np.argsort(-part_sizes, kind='stable').tolist() if part_sizes[part] > 0]
+        if self.deadline is None and self.time_limit is not None:
+            self.deadline = time.time() + self.time_limit
+        parts = [(self._get_part_input(buyer_parts, part), self.verbose, self.integral, self.solver_name, self.warm_start, self.max_flow, self.gap_budget, self.deadline) for part in order]
+
+        if self.jobs == 1:
+            results = [_solve_part(part) for part in parts]
+        else:
+            with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+                results = list(executor.map(_solve_part, parts))
+
+        fractional_values = np.zeros(len(self.var_buyers))
+        integral_values = np.zeros(len(self.var_buyers))
+        self.status = pulp.LpStatusOptimal
+        self.fractional_objective_value = 0.0
+        self.integral_objective_value = 0.0
+        for part, (status, fractional_objective_value, part_fractional_values, integral_objective_value, part_integral_values) in zip(order, results):
+            part_vars = (var_parts == part)
+            fractional_values[part_vars] = part_fractional_values
+            self.fractional_objective_value += fractional_objective_value
+            if self.integral:
+                integral_values[part_vars] = part_integral_values
+                self.integral_objective_value += integral_objective_value
+            # The status of the first part which is not solved to optimality
+            if self.status == pulp.LpStatusOptimal:
+                self.status = status
+
+        self.fractional_objective_value = ROUND(self.fractional_objective_value)
+        self.fractional_values = fractional_values.tolist()
+        if self.integral:
+            self.integral_values = integral_values.tolist()
 
 
     def solve(self):
-        if os.path.exists(self.cache_file):
+        if self.cache is not None:
             self._load_data_from_cache()
-            return self.fractional_objective_value
-
-        self.model = pulp.LpProblem(name='max-profit-bounded-allocation', sense=pulp.LpMaximize)
-        self._init_model('Binary')
-        self.model.solve(pulp.GUROBI_CMD(msg=self.print_solver_messages))
-        self.status = self.model.status
-        self.integral_objective_value = self.model.objective.value()
-        self.integral_solution = self._get_solution()
-
-        self.model = pulp.LpProblem(name='max-profit-bounded-allocation', sense=pulp.LpMaximize)
-        self._init_model('Continuous')
-        self.model.solve(pulp.GUROBI_CMD(msg=self.print_solver_messages))
-        self.fractional_objective_value = ROUND(self.model.objective.value())
-        self.fractional_solution = self._get_solution()
-
-        self._save_data_to_cache()
+            if self.status is not None and (not self.integral or self.integral_solution is not None):
+                return self.fractional_objective_value
+
+        # The connected components of the buyer-item graph are independent, a fragmented instance is solved by parts,
+        # except for the relaxation alone as a maximum flow, which does not grow with the number of components
+        buyer_parts, num_parts = (None, 1) if self.max_flow and not self.integral else self._get_parts()
+        if num_parts == 1:
+            self._solve_model()
+        else:
+            self._solve_parts(buyer_parts, num_parts)
+
+        self.fractional_solution = self._get_solution(self.fractional_values)
+        if self.integral:
+            self.integral_solution = self._get_solution(self.integral_values)
+
+        if self.cache is not None:
+            self._save_data_to_cache()
         return self.fractional_objective_value
 
 
-    def get_integrality_gap(self):
+    def _get_gap(self):
         ratio = (self.integral_objective_value / self.fractional_objective_value)
         return ROUND((1.0 - ratio) * 100)
 
 
+    def get_integrality_gap(self):
+        if self.integral_solution is None:
+            return None
+        return self._get_gap()
+
+
     def print_solution(self):
         print('The offline solution:')
         print(f'Status: {self.status} - {pulp.LpStatus[self.status]}')
         print(f'Objective value = {self.fractional_objective_value}')
-        print(f'Integrality gap = {self.get_integrality_gap()} %')
+        if self.integral_solution is not None:
+            print(f'Integrality gap = {self.get_integrality_gap()} %')
         print()
@@ -91,7 +91,7 @@ def Input_3():
 
 
 MANUAL_INPUTS = {
-    1: Input_1(),
-    2: Input_2(),
-    3: Input_3() # Instance 1 in the report
+    1: Input_1().compact(),
+    2: Input_2().compact(),
+    3: Input_3().compact() # Instance 1 in the report
 }
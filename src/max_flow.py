@@ -0,0 +1,203 @@
+import numpy as np
+
+from src.utils import FLOAT_PRECISION_DIGITS, ROUND, UNIT
+
+
+def _get_ranges(ptr, nodes):
+    # The concatenated index ranges ptr[node]:ptr[node + 1] of the nodes
+    starts = ptr[nodes]
+    lengths = ptr[nodes + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(len(offsets))
+
+
+def _get_new_nodes(nodes, levels):
+    # The distinct nodes without a level
+    new = np.zeros(len(levels), dtype=bool)
+    new[nodes] = True
+    new &= (levels == -1)
+    return np.flatnonzero(new)
+
+
+
+# The fractional offline optimum as a maximum flow: source -> item j with capacity price_j, item j ->
+# interested buyer i without capacity limit and buyer i -> sink with capacity budget_i. The flow on
+# the edge (j, i) is the amount buyer i spends on item j. The capacities are integers counted in units,
+# so the flow is exact. Dinic's algorithm runs on the incidence arrays: the edges (j, i) are the CSR
+# entries, the residual edges (i, j) exist where the flow is positive and are found through the CSC order.
+# The level graph of each phase is built with NumPy, the paths are searched on lists.
+class MaxFlowSolver:
+    def __init__(self, data):
+        data = data.compact()
+        self.item_ptr_array = data.item_ptr
+        self.item_buyer_array = data.item_buyers
+        self.entry_item_array = data.entry_items
+        self.buyer_ptr_array = data.buyer_ptr
+        self.buyer_entry_array = data.buyer_entries
+        # The buyer of each position in the CSC order
+        self.position_buyer_array = np.repeat(np.arange(len(data.budgets)), np.diff(data.buyer_ptr))
+
+        self.item_ptr = data.item_ptr.tolist()
+        self.item_buyers = data.item_buyers.tolist()
+        self.entry_items = data.entry_items.tolist()
+        self.prices = [round(x * UNIT) for x in data.prices.tolist()]
+        self.budgets = [round(x * UNIT) for x in data.budgets.tolist()]
+        self.price_array = np.array(self.prices, dtype=np.int64)
+        self.budget_array = np.array(self.budgets, dtype=np.int64)
+
+        self.flows = [0 for _ in self.item_buyers]
+        self.sold = [0 for _ in self.prices]
+        self.spent = [0 for _ in self.budgets]
+        self.objective_value = 0
+
+        # The level graph of the current phase: the levels of the nodes (-1 outside of it or removed), the level of
+        # the buyers at the sink and the residual edges of each buyer to the next level
+        self.item_levels = []
+        self.buyer_levels = []
+        self.sink_level = None
+        self.residual_ptr = []
+        self.residual_entries = []
+
+
+    def _init_flow(self):
+        # The paths of length one (the first phase) are found greedily: every item is sold to its interested buyers
+        # in turn, as far as their budgets allow
+        for j, price in enumerate(self.prices):
+            for e in range(self.item_ptr[j], self.item_ptr[j + 1]):
+                i = self.item_buyers[e]
+                amount = min(price - self.sold[j], self.budgets[i] - self.spent[i])
+                if amount > 0:
+                    self.flows[e] = amount
+                    self.sold[j] += amount
+                    self.spent[i] += amount
+
+
+    def _build_level_graph(self):
+        # Breadth-first search from the items with residual capacity (the sources), one level at a time.
+        # Returns the sources, or None if no buyer with remaining budget is reached.
+        flows = np.array(self.flows, dtype=np.int64)
+        item_levels = np.full(len(self.prices), -1)
+        buyer_levels = np.full(len(self.budgets), -1)
+        sources = np.flatnonzero(np.array(self.sold, dtype=np.int64) < self.price_array)
+        item_levels[sources] = 0
+        remaining_budgets = self.budget_array - np.array(self.spent, dtype=np.int64)
+
+        items = sources
+        level = 0
+        while True:
+            if len(items) == 0:
+                return None
+            buyers = _get_new_nodes(self.item_buyer_array[_get_ranges(self.item_ptr_array, items)], buyer_levels)
+            buyer_levels[buyers] = level + 1
+            if np.any(remaining_budgets[buyers] > 0):
+                break
+
+            entries = self.buyer_entry_array[_get_ranges(self.buyer_ptr_array, buyers)]
+            items = _get_new_nodes(self.entry_item_array[entries[flows[entries] > 0]], item_levels)
+            item_levels[items] = level + 2
+            level += 2
+
+        # The residual edges (i, j) of the level graph, grouped by buyer in the CSC order
+        position_levels = buyer_levels[self.position_buyer_array]
+        residual = flows[self.buyer_entry_array] > 0
+        residual &= position_levels >= 0
+        residual &= item_levels[self.entry_item_array[self.buyer_entry_array]] == position_levels + 1
+        residual_ptr = np.zeros(len(self.budgets) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.position_buyer_array[residual], minlength=len(self.budgets)), out=residual_ptr[1:])
+
+        self.item_levels = item_levels.tolist()
+        self.buyer_levels = buyer_levels.tolist()
+        self.sink_level = level + 1
+        self.residual_ptr = residual_ptr.tolist()
+        self.residual_entries = self.buyer_entry_array[residual].tolist()
+        return sources.tolist()
+
+
+    def _find_path(self, source_item, item_arcs, buyer_arcs):
+        # Depth-first search for a path in the level graph, using and advancing the current arcs of the nodes.
+        # The path alternates items and buyers, returns its entries (forward and residual edges alternately) or None.
+        # The nodes without a path to the sink are removed from the level graph by setting their level to -1.
+        item_levels = self.item_levels
+        buyer_levels = self.buyer_levels
+        entries = []
+        node = source_item
+        on_item = True
+        while True:
+            if on_item:
+                end = self.item_ptr[node + 1]
+                next_level = item_levels[node] + 1
+                while item_arcs[node] < end and buyer_levels[self.item_buyers[item_arcs[node]]] != next_level:
+                    item_arcs[node] += 1
+                if item_arcs[node] < end:
+                    e = item_arcs[node]
+                    entries.append(e)
+                    node = self.item_buyers[e]
+                    on_item = False
+                    continue
+                item_levels[node] = -1
+            elif buyer_levels[node] == self.sink_level:
+                if self.spent[node] < self.budgets[node]:
+                    return entries
+                buyer_levels[node] = -1
+            else:
+                # The residual edges lose their flow or their item during the phase, but no new one joins
+                end = self.residual_ptr[node + 1]
+                while buyer_arcs[node] < end:
+                    e = self.residual_entries[buyer_arcs[node]]
+                    if self.flows[e] > 0 and item_levels[self.entry_items[e]] != -1:
+                        break
+                    buyer_arcs[node] += 1
+                if buyer_arcs[node] < end:
+                    e = self.residual_entries[buyer_arcs[node]]
+                    entries.append(e)
+                    node = self.entry_items[e]
+                    on_item = True
+                    continue
+                buyer_levels[node] = -1
+
+            # Retreat from the dead node
+            if not entries:
+                return None
+            e = entries.pop()
+            node = self.item_buyers[e] if on_item else self.entry_items[e]
+            on_item = not on_item
+
+
+    def _augment(self, source_item, entries):
+        # The forward edges have no capacity limit, the residual edges carry back at most their flow
+        last_buyer = self.item_buyers[entries[-1]]
+        amount = min(self.prices[source_item] - self.sold[source_item], self.budgets[last_buyer] - self.spent[last_buyer])
+        for e in entries[1::2]:
+            amount = min(amount, self.flows[e])
+
+        for idx, e in enumerate(entries):
+            self.flows[e] += amount if idx % 2 == 0 else -amount
+        self.sold[source_item] += amount
+        self.spent[last_buyer] += amount
+
+
+    def solve(self):
+        self._init_flow()
+        while True:
+            sources = self._build_level_graph()
+            if sources is None:
+                break
+
+            # Blocking flow: augment from every source until it is sold or has no path left
+            item_arcs = self.item_ptr[:-1]
+            buyer_arcs = self.residual_ptr[:-1]
+            for j in sources:
+                while self.item_levels[j] == 0 and self.sold[j] < self.prices[j]:
+                    entries = self._find_path(j, item_arcs, buyer_arcs)
+                    if entries is None:
+                        break
+                    self._augment(j, entries)
+
+        self.objective_value = ROUND(sum(self.sold) / UNIT)
+        return self.objective_value
+
+
+    def get_fractions(self):
+        # The sold fraction of the item of each CSR entry to the buyer of the entry
+        prices = self.price_array.astype(float)[self.entry_item_array]
+        return np.round(np.array(self.flows, dtype=float) / np.maximum(prices, 1), FLOAT_PRECISION_DIGITS)
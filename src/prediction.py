@@ -1,20 +1,40 @@
-import random
+import numpy as np
 
-def include_prediction(items, error_rate, optimal_solution, seed):
-    random.seed(seed)
+from src.input import NO_PREDICTION
+from src.verification import get_assignment_arrays
 
-    for item_id in range(len(items)):
-        items[item_id].prediction = None
 
-    for buyer_id, assigned_items in enumerate(optimal_solution):
-        for item_id, fraction in assigned_items.items():
-            if fraction == 1.0:
-                # Impose error in the prediction, but keep it reasonable
-                if random.random() < error_rate:
-                    if len(items[item_id].interested_buyers) == 1:
-                        items[item_id].prediction = buyer_id
-                    else:
-                        remaining_buyers = set(items[item_id].interested_buyers).difference(set([buyer_id]))
-                        items[item_id].prediction = random.sample(remaining_buyers, 1)[0]
-                else: # The prediction is the optimal solution
-                    items[item_id].prediction = buyer_id
+def get_predictions(data, error_rates, optimal_solution, seed):
+    # The predictions of every error rate in one pass: row k holds the predicted buyer of each item
+    # for error_rates[k], or NO_PREDICTION if the item is not sold in the optimal solution.
+    # The random draws are shared by the error rates, so an item which is mispredicted for an error
+    # rate is mispredicted (to the same buyer) for every higher rate, and a row does not depend on
+    # the other requested rates.
+    data = data.compact()
+    num_items = len(data.prices)
+    rng = np.random.default_rng(seed)
+    draws = rng.random(num_items)
+    choices = rng.random(num_items)
+
+    # The buyer of each fully sold item in the optimal solution
+    buyer_ids, item_ids, fractions = get_assignment_arrays(optimal_solution)
+    sold = (fractions == 1.0)
+    optimal_buyers = np.full(num_items, NO_PREDICTION, dtype=np.int64)
+    optimal_buyers[item_ids[sold]] = buyer_ids[sold]
+
+    # Impose error in the prediction, but keep it reasonable: the wrong prediction is one of the
+    # other interested buyers, or the optimal buyer if nobody else wants the item
+    entries = np.flatnonzero(data.item_buyers == optimal_buyers[data.entry_items])
+    predicted_items = data.entry_items[entries]
+    starts = data.item_ptr[predicted_items]
+    positions = entries - starts
+    num_others = data.item_ptr[predicted_items + 1] - starts - 1
+    others = np.floor(choices[predicted_items] * num_others).astype(np.int64)
+    others += (others >= positions)
+    wrong_buyers = np.where(num_others > 0, data.item_buyers[np.minimum(starts + others, len(data.item_buyers) - 1)], optimal_buyers[predicted_items])
+
+    predictions = np.full((len(error_rates), num_items), NO_PREDICTION, dtype=np.int64)
+    for idx, error_rate in enumerate(error_rates):
+        wrong = draws[predicted_items] < error_rate
+        predictions[idx, predicted_items] = np.where(wrong, wrong_buyers, optimal_buyers[predicted_items])
+    return predictions
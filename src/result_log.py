@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+
+# One result cell: the objective value of a random iteration, error rate and eta in a solver mode, on the instance
+# with the content hash and with the LP solution of the cache key of the random iteration in that run
+RECORD_TYPE = np.dtype([
+    ('instance_hash', 'S32'),
+    ('lp_key', 'S64'),
+    ('random_idx', np.int64),
+    ('error', np.float64),
+    ('eta', np.float64),
+    ('stepped', np.bool_),
+    ('fixed_point', np.bool_),
+    ('objective_value', np.float64)
+])
+
+
+# Append-only binary log of the result cells. The records are appended (and flushed) as the work
+# units finish, so an interrupted run loses only the work units in progress, and a later run
+# computes only the missing cells. The records of other instances or LP solutions (a changed configuration,
+# generator or gap budget) are ignored, and so are the records of an older format. A partially written last
+# record is ignored.
+class ResultLog:
+    def __init__(self, log_file):
+        self.log_file = log_file
+
+
+    def load(self, keys, stepped, fixed_point):
+        # The keys are the (instance hash, LP cache key) pairs of the random iterations. Returns the objective values
+        # of the mode by (random_idx, error, eta), the last record of a cell wins.
+        if not os.path.exists(self.log_file):
+            return {}
+
+        num_records = os.path.getsize(self.log_file) // RECORD_TYPE.itemsize
+        records = np.fromfile(self.log_file, dtype=RECORD_TYPE, count=num_records)
+        records = records[(records['stepped'] == stepped) & (records['fixed_point'] == fixed_point)]
+        records = records[(records['random_idx'] >= 0) & (records['random_idx'] < len(keys))]
+        instance_hashes, lp_keys = self._get_key_arrays(keys)
+        records = records[(records['instance_hash'] == instance_hashes[records['random_idx']]) & (records['lp_key'] == lp_keys[records['random_idx']])]
+        cells = zip(records['random_idx'].tolist(), records['error'].tolist(), records['eta'].tolist())
+        return dict(zip(cells, records['objective_value'].tolist()))
+
+
+    def _get_key_arrays(self, keys):
+        instance_hashes = np.array([key[0] for key in keys], dtype=RECORD_TYPE['instance_hash'])
+        lp_keys = np.array([key[1] for key in keys], dtype=RECORD_TYPE['lp_key'])
+        return instance_hashes, lp_keys
+
+
+    def append(self, cells, keys, stepped, fixed_point):
+        # The cells are (random_idx, error, eta, objective_value) tuples
+        instance_hashes, lp_keys = self._get_key_arrays(keys)
+        records = np.array([(instance_hashes[cell[0]], lp_keys[cell[0]], *cell[:3], stepped, fixed_point, cell[3]) for cell in cells], dtype=RECORD_TYPE)
+        self._truncate()
+        with open(self.log_file, 'ab') as out_file:
+            out_file.write(records.tobytes())
+            out_file.flush()
+            os.fsync(out_file.fileno())
+
+
+    def _truncate(self):
+        # Drops a partially written last record, so the new records stay aligned
+        if os.path.exists(self.log_file):
+            size = os.path.getsize(self.log_file)
+            if size % RECORD_TYPE.itemsize != 0:
+                os.truncate(self.log_file, size - size % RECORD_TYPE.itemsize)
@@ -0,0 +1,172 @@
+import numpy as np
+import time
+
+from src.utils import ROUND, UNIT
+
+
+# A feasible integral solution from a fractional one, without a MIP solver: every item is sold to at most one
+# buyer within the budgets. The fractional solution is rounded (the largest fractions and prices first), the
+# unsold items are sold greedily to the interested buyers with the most budget left, then a local search swaps
+# unsold items in for cheaper items of the buyers, which are moved to another buyer if possible. The prices and
+# budgets are integers counted in units, so the budgets hold exactly. The objective value of the relaxation is
+# an upper bound on the integral optimum, so the gap to it is a certified bound on the gap of the heuristic.
+# The swaps stop at the deadline (a time.time() value), the solution is feasible at any time.
+class RoundingSolver:
+    def __init__(self, data, fractions, deadline=None):
+        data = data.compact()
+        self.item_ptr = data.item_ptr.tolist()
+        self.item_buyers = data.item_buyers.tolist()
+        self.price_array = np.round(data.prices * UNIT).astype(np.int64)
+        self.prices = self.price_array.tolist()
+        self.budgets = [round(x * UNIT) for x in data.budgets.tolist()]
+        self.entry_item_array = data.entry_items
+        self.entry_items = data.entry_items.tolist()
+
+        # The fractions of the CSR entries: buyer item_buyers[e] gets fractions[e] of item entry_items[e]
+        self.fractions = np.asarray(fractions, dtype=float)
+        self.deadline = deadline
+
+        # The entry of each item sold, or -1, the remaining budgets and the items of the buyers
+        self.item_entries = []
+        self.remaining_budgets = []
+        self.buyer_items = []
+        self.objective_value = 0
+        self._reset()
+
+
+    def _sell(self, e):
+        j = self.entry_items[e]
+        i = self.item_buyers[e]
+        self.item_entries[j] = e
+        self.remaining_budgets[i] -= self.prices[j]
+        self.buyer_items[i].append(j)
+
+
+    def _unsell(self, j):
+        e = self.item_entries[j]
+        i = self.item_buyers[e]
+        self.item_entries[j] = -1
+        self.remaining_budgets[i] += self.prices[j]
+        self.buyer_items[i].remove(j)
+
+
+    def _reset(self):
+        self.item_entries = [-1 for _ in self.prices]
+        self.remaining_budgets = list(self.budgets)
+        self.buyer_items = [[] for _ in self.budgets]
+
+
+    def _round(self):
+        # The entries of the fractional solution, by decreasing fraction and then by decreasing price
+        entries = np.flatnonzero(self.fractions > 0)
+        order = np.lexsort((-self.price_array[self.entry_item_array[entries]], -self.fractions[entries]))
+        for e in entries[order].tolist():
+            j = self.entry_items[e]
+            if self.item_entries[j] == -1 and self.remaining_budgets[self.item_buyers[e]] >= self.prices[j]:
+                self._sell(e)
+
+
+    def _find_entry(self, j, exclude=-1):
+        # The entry of item j to the interested buyer with the least budget left who can pay for it (best fit), or -1
+        best_entry = -1
+        best_budget = None
+        for e in range(self.item_ptr[j], self.item_ptr[j + 1]):
+            i = self.item_buyers[e]
+            if i != exclude and self.prices[j] <= self.remaining_budgets[i] and (best_budget is None or self.remaining_budgets[i] < best_budget):
+                best_entry = e
+                best_budget = self.remaining_budgets[i]
+        return best_entry
+
+
+    def _fill(self, items):
+        for j in items:
+            e = self._find_entry(j)
+            if e != -1:
+                self._sell(e)
+
+
+    def _make_room(self, i, need, max_budget):
+        # Moves items of buyer i (the most expensive first) to other buyers until need is freed from its budget, the
+        # items more expensive than the most budget left of any buyer cannot move. The moves are undone if it is not
+        # possible. Returns whether it is possible.
+        items = sorted((k for k in self.buyer_items[i] if self.prices[k] <= max_budget), key=lambda k: -self.prices[k])
+        moves = []
+        for k in items:
+            if need <= 0:
+                break
+            e = self._find_entry(k, exclude=i)
+            if e != -1:
+                moves.append((k, self.item_entries[k]))
+                self._unsell(k)
+                self._sell(e)
+                need -= self.prices[k]
+
+        if need > 0:
+            for k, e in reversed(moves):
+                self._unsell(k)
+                self._sell(e)
+        return need <= 0
+
+
+    def _swap(self, j):
+        # Sells the unsold item j to an interested buyer, who makes room by moving its items to other buyers (the
+        # gain is the price of j), or else by giving up a cheaper item (the gain is the difference of the prices).
+        # Returns whether the objective value improved.
+        best_gain = 0
+        best_swap = None
+        max_budget = max(self.remaining_budgets)
+        for e in range(self.item_ptr[j], self.item_ptr[j + 1]):
+            i = self.item_buyers[e]
+            if max_budget > 0 and self._make_room(i, self.prices[j] - self.remaining_budgets[i], max_budget):
+                self._sell(e)
+                return True
+
+            need = self.prices[j] - self.remaining_budgets[i]
+            for k in self.buyer_items[i]:
+                if need <= self.prices[k] < self.prices[j] - best_gain:
+                    best_gain = self.prices[j] - self.prices[k]
+                    best_swap = (e, k)
+
+        if best_swap is None:
+            return False
+        e, k = best_swap
+        self._unsell(k)
+        self._sell(e)
+        return True
+
+
+    def _search(self, items_by_price):
+        # The unsold items are sold greedily, then the swaps repeat while they improve the objective value
+        self._fill(j for j in items_by_price if self.item_entries[j] == -1)
+        improved = True
+        while improved:
+            improved = False
+            for j in items_by_price:
+                if self.deadline is not None and time.time() > self.deadline:
+                    improved = False
+                    break
+                if self.item_entries[j] == -1 and self._swap(j):
+                    improved = True
+        return sum(self.prices[j] for j, e in enumerate(self.item_entries) if e != -1)
+
+
+    def solve(self):
+        # The search starts from the rounded fractional solution and from scratch, the better result is kept
+        items_by_price = np.argsort(-self.price_array, kind='stable').tolist()
+        self._round()
+        best = (self._search(items_by_price), self.item_entries, self.remaining_budgets, self.buyer_items)
+
+        self._reset()
+        objective_value = self._search(items_by_price)
+        if objective_value < best[0]:
+            objective_value, self.item_entries, self.remaining_budgets, self.buyer_items = best
+
+        self.objective_value = ROUND(objective_value / UNIT)
+        return self.objective_value
+
+
+    def get_values(self):
+        # The integral values of the CSR entries, 1 for the buyer who gets the item and 0 otherwise
+        values = np.zeros(len(self.item_buyers))
+        values[[e for e in self.item_entries if e != -1]] = 1.0
+        return values
@@ -1,4 +1,6 @@
 FLOAT_PRECISION_DIGITS = 10
+# One unit of money and of item fraction in the integer computations, the precision of ROUND
+UNIT = 10 ** FLOAT_PRECISION_DIGITS
 
 def ROUND(value):
     return round(value, FLOAT_PRECISION_DIGITS)
@@ -1,29 +1,127 @@
-import sys
+import numpy as np
 
-def verify_solution(solution, data):
-    valid = True
-    budget_spent = [0 for _ in data.buyer_ids]
-    item_fractions = [0 for _ in data.item_ids]
+from dataclasses import dataclass, field
+from src.utils import FLOAT_PRECISION_DIGITS
 
-    for buyer_id, assigned_items in enumerate(solution):
-        for item_id, fraction in assigned_items.items():
-            if fraction < 0.0 or fraction > 1.0:
-                print(f'ERROR: Assigned fraction of {fraction} for buyer {buyer_id} of item {item_id}!')
-                valid = False
-            budget_spent[buyer_id] += fraction * data.items[item_id].price
-            item_fractions[item_id] += fraction
-
-    for buyer_id, spent in enumerate(budget_spent):
-        if round(spent, 2) > data.buyers[buyer_id].budget:
-            print(f'ERROR: Buyer {buyer_id} spent {spent} while its budget is {data.buyers[buyer_id].budget}!')
-            valid = False
-
-    for item_id, fraction in enumerate(item_fractions):
-        if round(fraction, 2) > 1.0:
+# The number of items whose fractions the incremental verifier of the batched solver checks at once
+BATCH_SIZE = 1024
+
+
+@dataclass
+class VerificationReport:
+    invalid_fractions: list = field(default_factory=list) # (buyer id, item id, fraction)
+    overspent_buyers: list = field(default_factory=list) # (buyer id, spent, budget)
+    oversold_items: list = field(default_factory=list) # (item id, sold fraction)
+
+
+    @property
+    def valid(self):
+        return not (self.invalid_fractions or self.overspent_buyers or self.oversold_items)
+
+
+    def print_report(self):
+        for buyer_id, item_id, fraction in self.invalid_fractions:
+            print(f'ERROR: Assigned fraction of {fraction} for buyer {buyer_id} of item {item_id}!')
+        for buyer_id, spent, budget in self.overspent_buyers:
+            print(f'ERROR: Buyer {buyer_id} spent {spent} while its budget is {budget}!')
+        for item_id, fraction in self.oversold_items:
             print(f'ERROR: Item {item_id} was sold in {fraction} fraction!')
-            valid = False
 
-    if not valid:
-        sys.exit('Verification failed!')
+        if self.valid:
+            print('Solution verified!\n')
+
+
+
+# Checks the invariants item by item while the solver runs: an item is decided once, so its
+# sold fraction is final. Only the sum and the least fraction of an item are compared, the
+# violations are collected only if they fail. The spent amounts only grow with valid fractions,
+# so the budgets are checked once at the end of a solve. The fractions of the batched solver
+# (one row per eta value) are checked in batches of items. The report collects the violations
+# of every solve checked by the verifier.
+class IncrementalVerifier:
+    def __init__(self, data):
+        self.budgets = data.budgets
+        self.batch = []
+        self.report = VerificationReport()
+
+
+    def check_item(self, item_id, allocation, unit=1):
+        # The fractions of the allocation are counted in units (1 for the float solver)
+        sold_fraction = 0
+        for fraction in allocation.values():
+            if fraction < 0:
+                break
+            sold_fraction += fraction
+        else:
+            if sold_fraction <= unit:
+                return
+
+        fractions = {buyer_id: fraction / unit for buyer_id, fraction in allocation.items()}
+        self._add_item_violations(item_id, list(fractions.keys()), list(fractions.values()))
+
+
+    def check_item_arrays(self, item_id, buyer_ids, fractions):
+        self.batch.append((item_id, buyer_ids, fractions))
+        if len(self.batch) == BATCH_SIZE:
+            self.check_batch()
+
+
+    def check_batch(self):
+        if not self.batch:
+            return
+        fractions = np.round(np.concatenate([x[2] for x in self.batch], axis=1), FLOAT_PRECISION_DIGITS)
+        starts = np.cumsum([0] + [len(x[1]) for x in self.batch[:-1]])
+        sold_fractions = np.add.reduceat(fractions, starts, axis=1)
+        if fractions.min() < 0.0 or fractions.max() > 1.0 or np.round(sold_fractions, 2).max() > 1.0:
+            for item_id, buyer_ids, item_fractions in self.batch:
+                for row in np.round(item_fractions, FLOAT_PRECISION_DIGITS):
+                    self._add_item_violations(item_id, buyer_ids.tolist(), row.tolist())
+        self.batch = []
 
-    print('Solution verified!\n')
+
+    def check_spent(self, spent, unit=1):
+        # The spent amounts of the buyers (one row per eta value for the batched solver) at the end of a solve
+        spent = np.atleast_2d(np.asarray(spent)) / unit
+        overspent = np.nonzero(np.round(spent, 2) > self.budgets)
+        self.report.overspent_buyers.extend(zip(overspent[1].tolist(), spent[overspent].tolist(), self.budgets[overspent[1]].tolist()))
+
+
+    def _add_item_violations(self, item_id, buyer_ids, fractions):
+        for buyer_id, fraction in zip(buyer_ids, fractions):
+            if fraction < 0.0 or fraction > 1.0:
+                self.report.invalid_fractions.append((buyer_id, item_id, fraction))
+
+        sold_fraction = sum(fractions)
+        if round(sold_fraction, 2) > 1.0:
+            self.report.oversold_items.append((item_id, sold_fraction))
+
+
+
+def get_assignment_arrays(solution):
+    # Converts the per buyer dictionaries to a sparse (COO) assignment: buyer ids, item ids, fractions
+    counts = [len(x) for x in solution]
+    buyer_ids = np.repeat(np.arange(len(solution)), counts)
+    item_ids = np.fromiter((item_id for x in solution for item_id in x), dtype=np.int64, count=sum(counts))
+    fractions = np.fromiter((fraction for x in solution for fraction in x.values()), dtype=float, count=sum(counts))
+    return buyer_ids, item_ids, fractions
+
+
+def verify_assignment(buyer_ids, item_ids, fractions, data):
+    report = VerificationReport()
+
+    invalid = np.flatnonzero((fractions < 0.0) | (fractions > 1.0))
+    report.invalid_fractions = list(zip(buyer_ids[invalid].tolist(), item_ids[invalid].tolist(), fractions[invalid].tolist()))
+
+    spent = np.bincount(buyer_ids, weights=fractions * data.prices[item_ids], minlength=len(data.budgets))
+    overspent = np.flatnonzero(np.round(spent, 2) > data.budgets)
+    report.overspent_buyers = list(zip(overspent.tolist(), spent[overspent].tolist(), data.budgets[overspent].tolist()))
+
+    sold_fractions = np.bincount(item_ids, weights=fractions, minlength=len(data.prices))
+    oversold = np.flatnonzero(np.round(sold_fractions, 2) > 1.0)
+    report.oversold_items = list(zip(oversold.tolist(), sold_fractions[oversold].tolist()))
+
+    return report
+
+
+def verify_solution(solution, data):
+    return verify_assignment(*get_assignment_arrays(solution), data.compact())
@@ -1,9 +1,17 @@
+import matplotlib
 import matplotlib.pyplot as plt
+import numpy as np
+import os
 import pandas as pd
-import seaborn as sns
 
+from concurrent.futures import ProcessPoolExecutor
 
-def plot_result(result_file):
+# The colorblind palette of seaborn, which is not imported as it takes seconds to import
+COLORS = ['#0173b2', '#de8f05', '#029e73', '#d55e00', '#cc78bc', '#ca9161', '#fbafe4', '#949494', '#ece133', '#56b4e9']
+MARKERS = ['o', 'X', 's', 'P', 'D', '^', 'v', 'p', '*', 'h']
+
+
+def _set_style():
     plt.rc('font', size=16)
     plt.rc('axes', titlesize=16)
     plt.rc('axes', labelsize=16)
@@ -11,38 +19,100 @@ def plot_result(result_file):
     plt.rc('ytick', labelsize=16)
     plt.rc('legend', fontsize=16)
 
-    data = pd.read_csv(result_file, sep=';',index_col=0)
+
+def _finish(figure, image_file):
+    # Saves the figure if an image file is given, otherwise shows it
+    figure.tight_layout()
+    if image_file is None:
+        plt.show()
+    else:
+        figure.savefig(image_file)
+        plt.close(figure)
+
+
+def get_image_file(csv_file):
+    return f'{os.path.splitext(csv_file)[0]}.png'
+
+
+def aggregate_result(data):
+    # The mean gap per prediction error and eta, with the 95% confidence interval of the mean
+    # over the random iterations (normal approximation)
+    aggregate = data.groupby(['PredictionError', 'Eta'])['Gap'].agg(['mean', 'std', 'count']).reset_index()
+    aggregate['ci'] = 1.96 * aggregate['std'].fillna(0.0) / np.sqrt(aggregate['count'])
+    return aggregate
+
+
+def plot_result(result_file, image_file=None):
+    _set_style()
+    aggregate = aggregate_result(pd.read_csv(result_file, sep=';', index_col=0))
+    errors = aggregate['PredictionError'].unique()
 
     figure, axis = plt.subplots(1, 1, figsize=(7, 7))
 
-    sns.lineplot(data=data, x='Eta', y='Gap', hue='PredictionError', linewidth=2,
-                palette='colorblind', style='PredictionError', markers=True, legend='full')
+    for idx, error in enumerate(errors):
+        rows = aggregate[aggregate['PredictionError'] == error]
+        color = COLORS[idx % len(COLORS)]
+        axis.plot(rows['Eta'], rows['mean'], color=color, linewidth=2, marker=MARKERS[idx % len(MARKERS)], label=str(error))
+        axis.fill_between(rows['Eta'], rows['mean'] - rows['ci'], rows['mean'] + rows['ci'], color=color, alpha=0.2)
 
     axis.set_xlabel(r'$\eta$')
     axis.set_ylabel('ALGO(I) / OPT(I)')
-    axis.legend(loc='lower right')
+    axis.legend(loc='lower right', title='PredictionError')
 
-    figure.tight_layout()
-    plt.show()
+    _finish(figure, image_file)
 
 
-def plot_metrics(metric_file):
-    plt.rc('font', size=16)
-    plt.rc('axes', titlesize=16)
-    plt.rc('axes', labelsize=16)
-    plt.rc('xtick', labelsize=16)
-    plt.rc('ytick', labelsize=16)
-    plt.rc('legend', fontsize=16)
+def fit_line(x, y, num_points=100):
+    # The least squares line on a grid over x, with the 95% confidence band of its mean (normal approximation)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    grid = np.linspace(x.min(), x.max(), num_points)
+    slope, intercept = np.polyfit(x, y, 1)
+    fitted = slope * grid + intercept
+
+    band = np.zeros(num_points)
+    if len(x) > 2:
+        residual_std = np.sqrt(np.sum((y - (slope * x + intercept)) ** 2) / (len(x) - 2))
+        spread = np.sum((x - x.mean()) ** 2)
+        band = 1.96 * residual_std * np.sqrt(1 / len(x) + (grid - x.mean()) ** 2 / spread)
+    return grid, fitted, band
 
+
+def plot_metrics(metric_file, image_file=None):
+    _set_style()
     data = pd.read_csv(metric_file, sep=';')
 
     figure, axis = plt.subplots(1, 1, figsize=(7, 7))
 
-    sns.regplot(data=data, x='ID', y='IntegralityGap')
+    axis.scatter(data['ID'], data['IntegralityGap'], color=COLORS[0])
+    if len(data) > 1:
+        grid, fitted, band = fit_line(data['ID'], data['IntegralityGap'])
+        axis.plot(grid, fitted, color=COLORS[0])
+        axis.fill_between(grid, fitted - band, fitted + band, color=COLORS[0], alpha=0.15)
 
     axis.set_xlabel('Random Iteration ID')
     axis.set_ylabel('Integrality Gap')
-    axis.legend(loc='lower right')
 
-    figure.tight_layout()
-    plt.show()
+    _finish(figure, image_file)
+
+
+def _export_plot(plot):
+    plot_function, csv_file = plot
+    image_file = get_image_file(csv_file)
+    plot_function(csv_file, image_file)
+    return image_file
+
+
+def _init_headless():
+    matplotlib.use('Agg')
+
+
+def export_plots(result_files, metric_files, jobs=1):
+    # Renders the files to images next to them without a display, in parallel if asked
+    plots = [(plot_result, x) for x in result_files] + [(plot_metrics, x) for x in metric_files]
+    _init_headless()
+    if jobs == 1:
+        return [_export_plot(plot) for plot in plots]
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_headless) as executor:
+        return list(executor.map(_export_plot, plots))